@@ -1,11 +1,14 @@
 import os
 import json
+import hashlib
 import requests
 import logging
 import re
 import io
 import os
 import tempfile
+import threading
+from contextlib import contextmanager
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, send_from_directory, Response, send_file
 from werkzeug.utils import secure_filename
 import uuid
@@ -19,7 +22,11 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev_key_for_session_sync')
-app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500 MB max upload size
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 500 * 1024 * 1024))  # Limite por requisição (upload direto ou bloco)
+
+# Uploads em partes: tamanho total aceito e tamanho sugerido de cada bloco
+MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', 20 * 1024 * 1024 * 1024))  # 20 GB
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))  # 8 MB
 
 # Usar caminhos de ambiente ou caminhos padrão locais
 app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', '/app/uploads')
@@ -37,6 +44,99 @@ os.makedirs(app.config['DATA_FOLDER'], exist_ok=True)
 def index():
     return render_template('index.html')
 
+def save_upload_with_hash(file, file_path, chunk_size=1024 * 1024):
+    """Grava o upload em disco calculando o SHA-256 do conteúdo na mesma passada."""
+    digest = hashlib.sha256()
+    with open(file_path, 'wb') as out:
+        for chunk in iter(lambda: file.stream.read(chunk_size), b''):
+            digest.update(chunk)
+            out.write(chunk)
+    return digest.hexdigest()
+
+def build_session_metadata(form, session_id, filename, file_path, content_hash=None, status='uploaded'):
+    """Monta os metadados da sessão a partir dos campos do formulário de envio."""
+    metadata = {
+        'session_id': session_id,
+        'original_filename': filename,
+        'upload_time': datetime.now().isoformat(),
+        'title': form.get('title', ''),
+        'date': form.get('date', ''),
+        'description': form.get('description', ''),
+        'file_path': file_path,
+        'content_hash': content_hash,
+        'status': status,
+        
+        # Campos para estruturação da ata
+        'ata': {
+            'numero_sessao': form.get('numero_sessao', ''),
+            'periodo': form.get('periodo', ''),
+            'numero_sessao_legislativa': form.get('numero_sessao_legislativa', ''),
+            'numero_legislatura': form.get('numero_legislatura', ''),
+            'cidade': form.get('cidade', ''),
+            'hora': form.get('hora', ''),
+            'minutos': form.get('minutos', ''),
+            'presidente': form.get('presidente', ''),
+            'primeiro_secretario': form.get('primeiro_secretario', ''),
+            'segundo_secretario': form.get('segundo_secretario', ''),
+            'vereadores_presentes': form.get('vereadores_presentes', ''),
+            'numero_presentes': form.get('numero_presentes', ''),
+            'numero_presentes_extenso': ''
+        }
+    }
+    
+    # Converter número de presentes para extenso se fornecido
+    if metadata['ata']['numero_presentes']:
+        try:
+            num = int(metadata['ata']['numero_presentes'])
+            # Função simplificada para converter números para extenso em português
+            unidades = ['zero', 'um', 'dois', 'três', 'quatro', 'cinco', 'seis', 'sete', 'oito', 'nove', 'dez',
+                       'onze', 'doze', 'treze', 'quatorze', 'quinze', 'dezesseis', 'dezessete', 'dezoito', 'dezenove']
+            dezenas = ['', '', 'vinte', 'trinta', 'quarenta', 'cinquenta']
+            
+            if num < 20:
+                metadata['ata']['numero_presentes_extenso'] = unidades[num]
+            elif num < 60:
+                if num % 10 == 0:
+                    metadata['ata']['numero_presentes_extenso'] = dezenas[num // 10]
+                else:
+                    metadata['ata']['numero_presentes_extenso'] = f"{dezenas[num // 10]} e {unidades[num % 10]}"
+        except ValueError:
+            pass  # Ignora se não for um número válido
+    
+    return metadata
+
+def save_session_metadata(metadata):
+    metadata_path = os.path.join(app.config['DATA_FOLDER'], f"{metadata['session_id']}.json")
+    with open(metadata_path, 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+def start_preprocessing(session_id, file_path, content_hash):
+    """Envia o arquivo ao serviço de pré-processamento. Retorna (ok, mensagem de erro)."""
+    try:
+        # Enviar o caminho do arquivo para o serviço de pré-processamento
+        response = requests.post(
+            f"{PREPROCESSING_SERVICE_URL}/preprocess",
+            json={
+                'session_id': session_id,
+                'file_path': file_path,
+                'content_hash': content_hash
+            },
+            timeout=5  # O serviço responde 202 assim que o job é registrado
+        )
+        
+        # Verificar resposta
+        if response.status_code in (200, 202):
+            job_id = response.json().get('job_id')
+            logger.info(f"Pré-processamento iniciado com sucesso para sessão {session_id} (job {job_id})")
+            # O serviço de pré-processamento já envia automaticamente para transcrição
+            return True, None
+        logger.error(f"Erro no pré-processamento: {response.text}")
+        return False, response.text
+    except (requests.RequestException, requests.Timeout) as e:
+        # Apenas registrar o erro; o processamento pode ser retomado depois
+        print(f"Aviso: Erro ao iniciar processamento (continuará em segundo plano): {str(e)}")
+        return True, None
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     if 'audio_file' not in request.files:
@@ -56,103 +156,183 @@ def upload_file():
         session_dir = os.path.join(app.config['UPLOAD_FOLDER'], session_id)
         os.makedirs(session_dir, exist_ok=True)
         
-        # Save the file
+        # Save the file, hashing its content while it streams to disk
         filename = secure_filename(file.filename)
         file_path = os.path.join(session_dir, filename)
-        file.save(file_path)
+        content_hash = save_upload_with_hash(file, file_path)
         
-        # Collect metadata
-        metadata = {
-            'session_id': session_id,
-            'original_filename': filename,
-            'upload_time': datetime.now().isoformat(),
-            'title': request.form.get('title', ''),
-            'date': request.form.get('date', ''),
-            'description': request.form.get('description', ''),
-            'file_path': file_path,
-            'status': 'uploaded',
-            
-            # Campos para estruturação da ata
-            'ata': {
-                'numero_sessao': request.form.get('numero_sessao', ''),
-                'periodo': request.form.get('periodo', ''),
-                'numero_sessao_legislativa': request.form.get('numero_sessao_legislativa', ''),
-                'numero_legislatura': request.form.get('numero_legislatura', ''),
-                'cidade': request.form.get('cidade', ''),
-                'hora': request.form.get('hora', ''),
-                'minutos': request.form.get('minutos', ''),
-                'presidente': request.form.get('presidente', ''),
-                'primeiro_secretario': request.form.get('primeiro_secretario', ''),
-                'segundo_secretario': request.form.get('segundo_secretario', ''),
-                'vereadores_presentes': request.form.get('vereadores_presentes', ''),
-                'numero_presentes': request.form.get('numero_presentes', ''),
-                'numero_presentes_extenso': ''
-            }
-        }
+        # Collect and save metadata
+        metadata = build_session_metadata(request.form, session_id, filename, file_path, content_hash)
+        save_session_metadata(metadata)
         
-        # Converter número de presentes para extenso se fornecido
-        if metadata['ata']['numero_presentes']:
-            try:
-                num = int(metadata['ata']['numero_presentes'])
-                # Função simplificada para converter números para extenso em português
-                unidades = ['zero', 'um', 'dois', 'três', 'quatro', 'cinco', 'seis', 'sete', 'oito', 'nove', 'dez',
-                           'onze', 'doze', 'treze', 'quatorze', 'quinze', 'dezesseis', 'dezessete', 'dezoito', 'dezenove']
-                dezenas = ['', '', 'vinte', 'trinta', 'quarenta', 'cinquenta']
-                
-                if num < 20:
-                    metadata['ata']['numero_presentes_extenso'] = unidades[num]
-                elif num < 60:
-                    if num % 10 == 0:
-                        metadata['ata']['numero_presentes_extenso'] = dezenas[num // 10]
-                    else:
-                        metadata['ata']['numero_presentes_extenso'] = f"{dezenas[num // 10]} e {unidades[num % 10]}"
-            except ValueError:
-                pass  # Ignora se não for um número válido
+        # Primeiro salvamos os metadados e redirecionamos o usuário
+        flash('Arquivo enviado com sucesso e está sendo processado')
         
-        # Save metadata
-        metadata_path = os.path.join(app.config['DATA_FOLDER'], f"{session_id}.json")
-        with open(metadata_path, 'w') as f:
-            json.dump(metadata, f, indent=2)
+        ok, error = start_preprocessing(session_id, file_path, content_hash)
+        if not ok:
+            flash(f"Erro no pré-processamento: {error}")
         
-        # Send to preprocessing service
-        try:
-            # Primeiro salvamos os metadados e redirecionamos o usuário
-            flash('Arquivo enviado com sucesso e está sendo processado')
-            
-            # Redirecionar para a página de status imediatamente
-            redirect_url = url_for('session_status_endpoint', session_id=session_id)
-            
-            # Enviar para o serviço de pré-processamento
-            try:
-                # Enviar o caminho do arquivo para o serviço de pré-processamento
-                response = requests.post(
-                    f"{PREPROCESSING_SERVICE_URL}/preprocess",
-                    json={
-                        'session_id': session_id,
-                        'file_path': file_path
-                    },
-                    timeout=5  # Timeout aumentado para permitir processamento de arquivos grandes
-                )
-                
-                # Verificar resposta
-                if response.status_code == 200:
-                    logger.info(f"Pré-processamento iniciado com sucesso para sessão {session_id}")
-                    # O serviço de pré-processamento já envia automaticamente para transcrição
-                else:
-                    logger.error(f"Erro no pré-processamento: {response.text}")
-                    flash(f"Erro no pré-processamento: {response.text}")
-            except (requests.RequestException, requests.Timeout) as e:
-                # Apenas registrar o erro, mas continuar com o redirecionamento
-                print(f"Aviso: Erro ao iniciar processamento (continuará em segundo plano): {str(e)}")
-            
-            # Redirecionar o usuário imediatamente
-            return redirect(redirect_url)
-        except requests.RequestException as e:
-            flash(f'Erro ao conectar ao serviço de pré-processamento: {str(e)}')
-            return redirect(url_for('index'))
+        # Redirecionar para a página de status imediatamente
+        return redirect(url_for('session_status_endpoint', session_id=session_id))
     
     return redirect(url_for('index'))
 
+# Uploads em partes (protocolo inspirado no tus): o cliente cria o upload,
+# envia blocos com PATCH informando o Upload-Offset e, após uma queda de
+# conexão, consulta o offset atual e continua de onde parou.
+upload_hashes = {}  # session_id -> hashlib.sha256 acumulado dos bytes já gravados
+upload_locks = {}   # session_id -> [threading.Lock, requisições usando ou esperando] (um PATCH por vez em cada upload)
+upload_registry_lock = threading.Lock()
+
+@contextmanager
+def upload_lock(session_id):
+    """Bloqueio do upload; a entrada só sai do registro quando nenhuma requisição a usa ou espera."""
+    with upload_registry_lock:
+        entry = upload_locks.setdefault(session_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with upload_registry_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                upload_locks.pop(session_id, None)
+
+def load_upload_metadata(session_id):
+    """Retorna os metadados de um upload em andamento, ou None se não existir."""
+    metadata_path = os.path.join(app.config['DATA_FOLDER'], f"{session_id}.json")
+    if not os.path.exists(metadata_path):
+        return None
+    with open(metadata_path, 'r') as f:
+        metadata = json.load(f)
+    if 'upload' not in metadata:
+        return None
+    return metadata
+
+def upload_offset(metadata):
+    """O tamanho do arquivo em disco é a fonte de verdade para o offset."""
+    file_path = metadata['file_path']
+    return os.path.getsize(file_path) if os.path.exists(file_path) else 0
+
+def upload_status_response(metadata, status_code=200, **extra):
+    offset = upload_offset(metadata)
+    body = {
+        'session_id': metadata['session_id'],
+        'offset': offset,
+        'length': metadata['upload']['length'],
+        'complete': metadata['upload'].get('complete', False),
+        'chunk_size': UPLOAD_CHUNK_SIZE
+    }
+    if body['complete']:
+        # Também nas respostas repetidas (HEAD, GET ou um PATCH reenviado após perder a resposta)
+        body['redirect_url'] = url_for('session_status_endpoint', session_id=metadata['session_id'])
+    body.update(extra)
+    response = jsonify(body)
+    response.status_code = status_code
+    response.headers['Upload-Offset'] = str(offset)
+    response.headers['Upload-Length'] = str(metadata['upload']['length'])
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """Cria um upload em partes e devolve o session_id que identifica o recurso."""
+    filename = secure_filename(request.form.get('filename', ''))
+    if not filename:
+        return jsonify({'error': 'Nome do arquivo não informado'}), 400
+    try:
+        length = int(request.headers.get('Upload-Length') or request.form.get('length', ''))
+    except ValueError:
+        return jsonify({'error': 'Tamanho do arquivo (Upload-Length) inválido'}), 400
+    if length <= 0 or length > MAX_UPLOAD_SIZE:
+        return jsonify({'error': f'Tamanho do arquivo fora do limite de {MAX_UPLOAD_SIZE} bytes'}), 413
+    
+    session_id = str(uuid.uuid4())
+    session_dir = os.path.join(app.config['UPLOAD_FOLDER'], session_id)
+    os.makedirs(session_dir, exist_ok=True)
+    file_path = os.path.join(session_dir, filename)
+    open(file_path, 'wb').close()
+    
+    metadata = build_session_metadata(request.form, session_id, filename, file_path, status='uploading')
+    metadata['upload'] = {'length': length, 'complete': False}
+    save_session_metadata(metadata)
+    upload_hashes[session_id] = hashlib.sha256()
+    
+    logger.info(f"Upload em partes criado para sessão {session_id}: {filename} ({length} bytes)")
+    response = upload_status_response(metadata, status_code=201)
+    response.headers['Location'] = url_for('upload_chunk', session_id=session_id)
+    return response
+
+@app.route('/api/uploads/<session_id>', methods=['HEAD', 'GET'])
+def get_upload_offset(session_id):
+    metadata = load_upload_metadata(session_id)
+    if metadata is None:
+        return jsonify({'error': 'Upload não encontrado'}), 404
+    return upload_status_response(metadata)
+
+@app.route('/api/uploads/<session_id>', methods=['PATCH'])
+def upload_chunk(session_id):
+    """Acrescenta um bloco ao arquivo, exigindo que o Upload-Offset confira com o disco."""
+    try:
+        client_offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return jsonify({'error': 'Cabeçalho Upload-Offset ausente ou inválido'}), 400
+    
+    with upload_lock(session_id):
+        # Lidos com o bloqueio: um PATCH repetido depois do último bloco vê o upload já concluído
+        metadata = load_upload_metadata(session_id)
+        if metadata is None:
+            return jsonify({'error': 'Upload não encontrado'}), 404
+        if metadata['upload'].get('complete'):
+            return upload_status_response(metadata)
+        
+        offset = upload_offset(metadata)
+        if client_offset != offset:
+            # O cliente deve retomar a partir do offset devolvido
+            return upload_status_response(metadata, status_code=409, error='Offset divergente')
+        
+        chunk = request.get_data(cache=False)
+        length = metadata['upload']['length']
+        if offset + len(chunk) > length:
+            return upload_status_response(metadata, status_code=413, error='Bloco excede o tamanho declarado')
+        
+        # Checksum opcional do bloco: "Upload-Checksum: sha256 <hex>"
+        checksum = request.headers.get('Upload-Checksum')
+        if checksum:
+            algorithm, _, expected = checksum.partition(' ')
+            if algorithm.lower() != 'sha256' or hashlib.sha256(chunk).hexdigest() != expected.strip().lower():
+                logger.warning(f"Checksum divergente no upload {session_id} (offset {offset})")
+                return upload_status_response(metadata, status_code=460, error='Checksum do bloco divergente')
+        
+        digest = upload_hashes.get(session_id)
+        if digest is None:
+            # Serviço reiniciado no meio do upload: refazer o hash do que já está em disco
+            digest = hashlib.sha256()
+            with open(metadata['file_path'], 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+            upload_hashes[session_id] = digest
+        
+        with open(metadata['file_path'], 'ab') as out:
+            out.write(chunk)
+        digest.update(chunk)
+        
+        if offset + len(chunk) < length:
+            return upload_status_response(metadata)
+        
+        # Último bloco: registrar o hash e iniciar o pré-processamento
+        content_hash = digest.hexdigest()
+        upload_hashes.pop(session_id, None)
+        metadata['upload']['complete'] = True
+        metadata['content_hash'] = content_hash
+        metadata['status'] = 'uploaded'
+        save_session_metadata(metadata)
+        logger.info(f"Upload em partes concluído para sessão {session_id} (sha256 {content_hash})")
+    
+    ok, error = start_preprocessing(session_id, metadata['file_path'], content_hash)
+    return upload_status_response(metadata, preprocessing_error=None if ok else error)
+
 @app.route('/sessions')
 def list_sessions():
     sessions = []
@@ -178,7 +358,8 @@ def session_status(session_id):
         'session.html', 
         session=session_data, 
         session_id=session_id,
-        has_transcript=has_transcript
+        has_transcript=has_transcript,
+        quality_tiers=summarize_quality_tiers(session_data)
     )
 
 @app.route('/download_transcript/<session_id>')
@@ -287,6 +468,7 @@ def get_session_api_status(session_id):
             # Continuar com os dados locais em caso de erro
     
     # Retornar dados da sessão
+    session_data['quality_tiers'] = summarize_quality_tiers(session_data)
     return jsonify(session_data)
 
 @app.route('/api/reprocess/<session_id>', methods=['POST'])
@@ -341,6 +523,19 @@ def get_session_data(session_id):
     
     return session_data
 
+def summarize_quality_tiers(session_data):
+    """Contagem dos segmentos da transcrição por nível de qualidade.
+    
+    No pipeline em duas passadas os segmentos chegam como 'draft' (modelo
+    pequeno) e são substituídos pela versão 'final' depois; transcrições
+    antigas, sem o campo, contam como finais.
+    """
+    tiers = {'draft': 0, 'final': 0}
+    for segment in session_data.get('transcript') or []:
+        tier = segment.get('quality_tier', 'final')
+        tiers[tier] = tiers.get(tier, 0) + 1
+    return tiers
+
 @app.route('/api/session/analyze/<session_id>', endpoint='analyze_session_integrity')
 def analyze_session_integrity(session_id):
     """Analisa o status da sessão verificando segmentos faltantes e frases sem timestamps.
@@ -805,7 +1000,8 @@ def edit_ata(session_id):
                            metadata=metadata,
                            marcadores=marcadores,
                            templates=templates,
-                           tipos_sessao=list(config.get('tipos_sessao', {}).keys()))
+                           tipos_sessao=list(config.get('tipos_sessao', {}).keys()),
+                           quality_tiers=summarize_quality_tiers(session_data))
 
 @app.route('/view_ata/<session_id>')
 def view_ata(session_id):
@@ -1052,7 +1248,8 @@ def new_ata(session_id):
                            session=session_data, 
                            tipo_sessao=tipo_sessao, 
                            metadata=metadata, 
-                           is_new=False)
+                           is_new=False,
+                           quality_tiers=summarize_quality_tiers(session_data))
 
 def get_session_data(session_id):
     """Obtém os dados de uma sessão específica pelo ID."""
@@ -1092,7 +1289,8 @@ def get_transcript(session_id):
     
     return jsonify({
         'success': True,
-        'transcript': transcript
+        'transcript': transcript,
+        'quality_tiers': summarize_quality_tiers(session_data)
     })
 
 def get_all_sessions():
@@ -1,12 +1,19 @@
 import os
 import json
+import hashlib
 import requests
 from flask import Flask, request, jsonify
 import logging
 from datetime import datetime
 import subprocess
 import uuid
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.utils import secure_filename
+import wave
+import numpy as np
+from audio_inspect import inspect_wav, find_quiet_point
 
 app = Flask(__name__)
 # Configurações
@@ -16,6 +23,33 @@ app.config['DATA_FOLDER'] = os.environ.get('DATA_FOLDER', '/app/data')
 # Service URLs from environment variables
 TRANSCRIPTION_SERVICE_URL = os.environ.get('TRANSCRIPTION_SERVICE_URL', 'http://localhost:5002')
 
+# Executor limitado para os jobs de pré-processamento (FFmpeg é pesado, poucos em paralelo)
+max_workers = int(os.environ.get('PREPROCESS_MAX_WORKERS', 2))
+max_pending_jobs = int(os.environ.get('PREPROCESS_MAX_PENDING_JOBS', 20))
+executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='preprocess')
+
+# Estado dos jobs em memória, indexado por job_id
+jobs = {}
+jobs_lock = threading.Lock()
+# Jobs finalizados ficam consultáveis em /jobs/<id> por este tempo e depois são descartados
+job_ttl_seconds = int(os.environ.get('PREPROCESS_JOB_TTL', 3600))
+
+# Segmentação: 'sequential' (um único ffmpeg -f segment) ou 'parallel' (faixas -ss/-t em paralelo)
+SEGMENT_DURATION = 900  # 15 minutos
+AUDIO_FILTERS = "highpass=f=200,lowpass=f=3000,volume=1.5,dynaudnorm"
+segmentation_mode = os.environ.get('SEGMENTATION_MODE', 'sequential')
+# Padrão: CPUs que o processo pode usar (não as do host), no máximo 4; o limite de cpus do
+# docker-compose não muda a afinidade, então em hosts grandes defina SEGMENT_WORKERS explicitamente
+available_cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+segment_workers = int(os.environ.get('SEGMENT_WORKERS', min(available_cpus, 4)))
+
+# Limites dos segmentos: 'fixed' (cortes a cada 900s) ou 'silence' (ponto mais silencioso perto do alvo)
+segment_boundaries = os.environ.get('SEGMENT_BOUNDARIES', 'fixed')
+silence_search_window = float(os.environ.get('SILENCE_SEARCH_WINDOW', 30))  # segundos para cada lado do alvo
+
+# Enviar cada segmento para a transcrição assim que o FFmpeg o fecha
+pipelined_handoff = os.environ.get('PIPELINED_HANDOFF', 'false').lower() == 'true'
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -24,90 +58,532 @@ logger = logging.getLogger(__name__)
 os.makedirs(app.config['DATA_FOLDER'], exist_ok=True)
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+if segment_boundaries == 'silence' and segmentation_mode == 'parallel':
+    logger.warning("SEGMENT_BOUNDARIES=silence ignora SEGMENTATION_MODE=parallel: os cortes em silêncio usam um único FFmpeg")
+
 def update_session_status(session_id, status, **kwargs):
-    """Update session status in metadata file with additional information."""
+    """Update session status in metadata file with additional information.
+    
+    Usa o mesmo protocolo do serviço de transcrição, que grava o mesmo JSON:
+    bloqueio em `<arquivo>.lock` criado com O_EXCL (obsoleto após 30 s) e
+    gravação atômica via arquivo temporário.
+    """
     metadata_path = os.path.join(app.config['DATA_FOLDER'], f"{session_id}.json")
+    lock_file = f"{metadata_path}.lock"
     
-    if os.path.exists(metadata_path):
-        with open(metadata_path, 'r') as f:
-            metadata = json.load(f)
-        
-        # Atualizar status se fornecido
-        if status:
-            metadata['status'] = status
-        
-        # Adicionar timestamp de atualização
-        metadata['last_updated'] = datetime.now().isoformat()
-        
-        # Adicionar informações adicionais
-        for key, value in kwargs.items():
-            metadata[key] = value
-        
-        with open(metadata_path, 'w') as f:
-            json.dump(metadata, f, indent=2)
+    for retry in range(10):
+        if not os.path.exists(metadata_path):
+            return False
+        try:
+            lock_fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_file) > 30:
+                    logger.warning(f"Removendo bloqueio obsoleto para sessão {session_id}")
+                    os.remove(lock_file)
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(0.5 * (retry + 1))
+            continue
+        with os.fdopen(lock_fd, 'w') as f:
+            f.write(f"Locked by process {os.getpid()} at {datetime.now().isoformat()}")
         
-        return True
+        try:
+            with open(metadata_path, 'r') as f:
+                metadata = json.load(f)
+            
+            # Atualizar status se fornecido
+            if status:
+                metadata['status'] = status
+            
+            # Adicionar timestamp de atualização
+            metadata['last_updated'] = datetime.now().isoformat()
+            
+            # Adicionar informações adicionais
+            for key, value in kwargs.items():
+                metadata[key] = value
+            
+            temp_path = f"{metadata_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(metadata, f, indent=2)
+            os.replace(temp_path, metadata_path)
+            return True
+        finally:
+            if os.path.exists(lock_file):
+                os.remove(lock_file)
     
+    logger.error(f"Falha ao atualizar status da sessão {session_id}: bloqueio ocupado")
     return False
 
 import subprocess
 import uuid
 
+def update_job(job_id, **kwargs):
+    """Atualiza o estado de um job de pré-processamento."""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            return False
+        job.update(kwargs)
+        job['updated_at'] = datetime.now().isoformat()
+        return True
+
+def prune_finished_jobs():
+    """Descarta os jobs finalizados há mais de job_ttl_seconds (chamar com jobs_lock)."""
+    now = datetime.now()
+    expired = [job_id for job_id, job in jobs.items()
+               if job['status'] in ('completed', 'failed')
+               and (now - datetime.fromisoformat(job['updated_at'])).total_seconds() > job_ttl_seconds]
+    for job_id in expired:
+        del jobs[job_id]
+
+def reserve_job():
+    """Registra um job na fila, ou retorna None se já houver max_pending_jobs não finalizados.
+    
+    A contagem e o registro acontecem sob o mesmo lock, para que requisições
+    simultâneas não ultrapassem o limite.
+    """
+    with jobs_lock:
+        prune_finished_jobs()
+        if sum(1 for job in jobs.values() if job['status'] in ('queued', 'running')) >= max_pending_jobs:
+            return None
+        job_id = str(uuid.uuid4())
+        jobs[job_id] = {
+            'job_id': job_id,
+            'session_id': None,
+            'status': 'queued',
+            'stage': 'queued',
+            'progress': 0.0,
+            'created_at': datetime.now().isoformat(),
+            'updated_at': datetime.now().isoformat()
+        }
+        return job_id
+
+def discard_job(job_id):
+    with jobs_lock:
+        jobs.pop(job_id, None)
+
 @app.route('/preprocess', methods=['POST'])
 def preprocess_audio():
     """Endpoint para pré-processamento de áudio.
     
     Recebe um arquivo de áudio ou um caminho para um arquivo já existente,
-    segmenta em partes menores e envia para o serviço de transcrição.
+    registra um job e retorna 202 imediatamente. A segmentação e o envio
+    para o serviço de transcrição acontecem no executor em segundo plano.
     """
-    # Verificar se estamos recebendo um arquivo ou um JSON com caminho
-    if 'file' in request.files:
-        # Recebendo um arquivo diretamente
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'error': 'Nenhum arquivo selecionado'}), 400
-        
-        # Gerar ID de sessão único
-        session_id = str(uuid.uuid4())
-        
-        # Criar diretório para a sessão
-        session_dir = os.path.join(app.config['UPLOAD_FOLDER'], session_id)
-        os.makedirs(session_dir, exist_ok=True)
+    # Recusar novos jobs se a fila estiver cheia; a vaga é reservada já na entrada
+    job_id = reserve_job()
+    if job_id is None:
+        return jsonify({'error': 'Too many preprocessing jobs pending, try again later'}), 503
+    
+    submitted = False
+    try:
+        # Verificar se estamos recebendo um arquivo ou um JSON com caminho
+        if 'file' in request.files:
+            # Recebendo um arquivo diretamente
+            file = request.files['file']
+            if file.filename == '':
+                return jsonify({'error': 'Nenhum arquivo selecionado'}), 400
         
-        # Salvar o arquivo
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(session_dir, filename)
-        file.save(file_path)
+            # Gerar ID de sessão único
+            session_id = str(uuid.uuid4())
         
-        # Criar metadados básicos
-        metadata = {
-            'session_id': session_id,
-            'original_filename': filename,
-            'upload_time': datetime.now().isoformat(),
-            'file_path': file_path,
-            'status': 'uploaded'
-        }
+            # Criar diretório para a sessão
+            session_dir = os.path.join(app.config['UPLOAD_FOLDER'], session_id)
+            os.makedirs(session_dir, exist_ok=True)
         
-        # Salvar metadados
-        metadata_path = os.path.join(app.config['DATA_FOLDER'], f"{session_id}.json")
-        with open(metadata_path, 'w') as f:
-            json.dump(metadata, f, indent=2)
+            # Salvar o arquivo calculando o hash do conteúdo durante a gravação
+            filename = secure_filename(file.filename)
+            file_path = os.path.join(session_dir, filename)
+            content_hash = save_upload_with_hash(file, file_path)
+        
+            # Criar metadados básicos
+            metadata = {
+                'session_id': session_id,
+                'original_filename': filename,
+                'upload_time': datetime.now().isoformat(),
+                'file_path': file_path,
+                'content_hash': content_hash,
+                'status': 'uploaded'
+            }
+        
+            # Salvar metadados
+            metadata_path = os.path.join(app.config['DATA_FOLDER'], f"{session_id}.json")
+            with open(metadata_path, 'w') as f:
+                json.dump(metadata, f, indent=2)
+        else:
+            # Recebendo um JSON com informações do arquivo
+            data = request.json
+            if not data or 'session_id' not in data or 'file_path' not in data:
+                return jsonify({'error': 'Missing required parameters'}), 400
+        
+            session_id = data['session_id']
+            file_path = data['file_path']
+            content_hash = data.get('content_hash')
+        
+            if not os.path.exists(file_path):
+                return jsonify({'error': f'File not found: {file_path}'}), 404
+    
+        # Associar o job reservado à sessão
+        update_job(job_id, session_id=session_id)
+    
+        # Atualizar status da sessão
+        update_session_status(session_id, 'preprocessing', status_detail='Na fila de pré-processamento', preprocessing_job_id=job_id)
+    
+        executor.submit(run_preprocessing_job, job_id, session_id, file_path, content_hash)
+        submitted = True
+        logger.info(f"Job de pré-processamento {job_id} registrado para a sessão {session_id}")
+    
+        return jsonify({
+            'status': 'accepted',
+            'job_id': job_id,
+            'session_id': session_id,
+            'status_url': f"/jobs/{job_id}"
+        }), 202
+    finally:
+        # Requisição recusada ou com erro antes de o job entrar no executor: liberar a vaga
+        if not submitted:
+            discard_job(job_id)
+
+def probe_duration(path):
+    """Obtém a duração total de um arquivo de áudio em segundos via ffprobe."""
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True
+    )
+    return float(result.stdout.strip())
+
+def segment_audio(file_path, session_dir, on_segment=None):
+    """Gera os segmentos WAV de 16 kHz mono conforme o modo configurado.
+    
+    Se `on_segment` for informado, ele é chamado com (index, filename, start, end)
+    para cada segmento assim que o arquivo estiver completo, em ordem de índice.
+    SEGMENT_BOUNDARIES=silence e SEGMENTATION_MODE=parallel são mutuamente
+    exclusivos: os cortes em silêncio dependem do corte anterior e usam um único FFmpeg.
+    """
+    if segment_boundaries == 'silence':
+        segment_audio_at_silences(file_path, session_dir, on_segment)
+    elif segmentation_mode == 'parallel':
+        segment_audio_parallel(file_path, session_dir, on_segment)
     else:
-        # Recebendo um JSON com informações do arquivo
-        data = request.json
-        if not data or 'session_id' not in data or 'file_path' not in data:
-            return jsonify({'error': 'Missing required parameters'}), 400
+        segment_audio_sequential(file_path, session_dir, on_segment)
+
+def segment_audio_sequential(file_path, session_dir, on_segment=None):
+    """Segmenta o áudio com um único processo FFmpeg (-f segment)."""
+    # Padrão para os arquivos de segmento (usando WAV para melhor compatibilidade com PCM)
+    segment_pattern = os.path.join(session_dir, "segment_%03d.wav")
+    
+    # Comando FFmpeg para segmentar o áudio com pré-processamento para melhorar a qualidade da transcrição
+    command = [
+        "ffmpeg", "-y", "-i", file_path,
+        # Filtros de áudio para melhorar a qualidade da transcrição
+        "-af", AUDIO_FILTERS,
+        # Configuração de segmentação
+        "-f", "segment", "-segment_time", str(SEGMENT_DURATION),
+        # Configuração de áudio otimizada para Whisper
+        "-c:a", "pcm_s16le",  # Formato PCM 16-bit (melhor para transcrição)
+        "-ac", "1",  # Mono
+        "-ar", "16000",  # 16kHz (ideal para Whisper)
+        segment_pattern
+    ]
+    
+    if on_segment is None:
+        # Executar o comando
+        subprocess.run(command, check=True)
+        return
+    
+    # O FFmpeg acrescenta uma linha "arquivo,início,fim" à lista quando fecha cada segmento
+    list_path = os.path.join(session_dir, "segments.csv")
+    if os.path.exists(list_path):
+        os.remove(list_path)
+    command[-1:-1] = ["-segment_list", list_path, "-segment_list_type", "csv"]
+    
+    process = subprocess.Popen(command, stdin=subprocess.DEVNULL)
+    try:
+        watch_segment_list(process, list_path, on_segment)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+def watch_segment_list(process, list_path, on_segment, poll_interval=1.0):
+    """Acompanha a lista de segmentos do FFmpeg até o processo terminar."""
+    entries_seen = 0
+    while True:
+        finished = process.poll() is not None
         
-        session_id = data['session_id']
-        file_path = data['file_path']
+        if os.path.exists(list_path):
+            with open(list_path, 'r') as f:
+                # A última parte pode ser uma linha ainda incompleta
+                lines = f.read().split('\n')[:-1]
+            for line in lines[entries_seen:]:
+                filename, start, end = line.rsplit(',', 2)
+                on_segment(entries_seen, os.path.basename(filename.strip('"')), float(start), float(end))
+                entries_seen += 1
         
-        if not os.path.exists(file_path):
-            return jsonify({'error': f'File not found: {file_path}'}), 404
+        if finished:
+            return entries_seen
+        time.sleep(poll_interval)
+
+def encode_time_range(file_path, start, duration, output_path):
+    """Aplica a cadeia de filtros a uma faixa [start, start + duration) do arquivo."""
+    command = [
+        "ffmpeg", "-y", "-nostdin",
+        "-ss", f"{start:.3f}", "-t", f"{duration:.3f}", "-i", file_path,
+        "-af", AUDIO_FILTERS,
+        "-c:a", "pcm_s16le",
+        "-ac", "1",
+        "-ar", "16000",
+        output_path
+    ]
+    subprocess.run(command, check=True, capture_output=True)
+    return output_path
+
+def segment_audio_parallel(file_path, session_dir, on_segment=None):
+    """Segmenta o áudio em faixas de tempo codificadas em paralelo.
+    
+    A duração é obtida uma única vez; cada faixa de SEGMENT_DURATION segundos
+    vira um processo FFmpeg próprio, com até `segment_workers` simultâneos.
+    Os nomes e tempos de início são os mesmos do modo sequencial.
+    """
+    total_duration = probe_duration(file_path)
+    ranges = []
+    start = 0.0
+    while start < total_duration:
+        ranges.append((start, min(SEGMENT_DURATION, total_duration - start)))
+        start += SEGMENT_DURATION
     
-    # Atualizar status da sessão
-    update_session_status(session_id, 'preprocessing')
+    logger.info(f"Segmentação paralela: {len(ranges)} faixas com {segment_workers} processos FFmpeg")
     
+    # Cada thread apenas aguarda o seu processo FFmpeg; o trabalho pesado roda fora do GIL
+    with ThreadPoolExecutor(max_workers=segment_workers, thread_name_prefix='segment') as pool:
+        futures = [
+            pool.submit(encode_time_range, file_path, range_start, range_duration,
+                        os.path.join(session_dir, f"segment_{i:03d}.wav"))
+            for i, (range_start, range_duration) in enumerate(ranges)
+        ]
+        for i, future in enumerate(futures):
+            future.result()
+            if on_segment is not None:
+                range_start, range_duration = ranges[i]
+                on_segment(i, f"segment_{i:03d}.wav", range_start, range_start + range_duration)
+
+def write_wav(path, samples, sample_rate):
+    """Grava amostras PCM 16-bit mono em um arquivo WAV."""
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(samples.tobytes())
+
+def segment_audio_at_silences(file_path, session_dir, on_segment=None):
+    """Segmenta o áudio cortando nas pausas mais próximas de cada limite de 15 minutos.
+    
+    O FFmpeg decodifica o arquivo (com a cadeia de filtros) em PCM 16 kHz pela
+    saída padrão. Cada alvo fica SEGMENT_DURATION segundos após o corte anterior e
+    o corte real é o trecho mais silencioso dentro de ±silence_search_window; assim
+    que o áudio até o fim dessa janela foi decodificado, o segmento é gravado e
+    entregue, sem esperar o arquivo inteiro. Só o trecho ainda não cortado fica em memória.
+    """
+    sample_rate = 16000
+    command = [
+        "ffmpeg", "-nostdin", "-i", file_path,
+        "-af", AUDIO_FILTERS,
+        "-f", "s16le",
+        "-ac", "1",
+        "-ar", str(sample_rate),
+        "pipe:1"
+    ]
+    # Com mais áudio que isso após o último corte, o próximo corte já pode ser calculado
+    cut_threshold = int((SEGMENT_DURATION + silence_search_window) * sample_rate)
+    pending = []  # blocos decodificados após o último corte
+    pending_samples = 0
+    segment_start = 0  # amostra (absoluta) do início do próximo segmento
+    index = 0
+    cuts = []
+    
+    def emit(samples):
+        nonlocal segment_start, index
+        filename = f"segment_{index:03d}.wav"
+        write_wav(os.path.join(session_dir, filename), samples, sample_rate)
+        if on_segment is not None:
+            on_segment(index, filename, segment_start / sample_rate, (segment_start + len(samples)) / sample_rate)
+        segment_start += len(samples)
+        index += 1
+    
+    process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+    try:
+        leftover = b''
+        while True:
+            data = process.stdout.read(1024 * 1024)
+            if data:
+                data = leftover + data
+                # Uma leitura pode terminar no meio de uma amostra de 2 bytes
+                usable = len(data) - len(data) % 2
+                leftover = data[usable:]
+                block = np.frombuffer(data[:usable], dtype='<i2')
+                pending.append(block)
+                pending_samples += len(block)
+            
+            while pending_samples > cut_threshold:
+                samples = np.concatenate(pending)
+                cut = find_quiet_point(samples, sample_rate, SEGMENT_DURATION, silence_search_window)
+                if cut <= 0:
+                    cut = SEGMENT_DURATION * sample_rate
+                cuts.append(segment_start + cut)
+                emit(samples[:cut])
+                pending = [samples[cut:]]
+                pending_samples = len(pending[0])
+            
+            if not data:
+                break
+        
+        process.wait()
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, command)
+        if pending_samples or index == 0:
+            emit(np.concatenate(pending) if pending else np.zeros(0, dtype='<i2'))
+        logger.info(f"Cortes alinhados a silêncio (s): {[round(cut / sample_rate, 3) for cut in cuts]}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+def build_segment(index, filename, segment_path, start_time, fallback_duration=SEGMENT_DURATION):
+    """Monta o dicionário de um segmento lendo duração e níveis do cabeçalho WAV."""
+    segment = {
+        'index': index,
+        'filename': filename,
+        'path': segment_path,
+        'start_time': start_time
+    }
+    try:
+        info = inspect_wav(segment_path)
+        duration = info['duration']
+        segment['rms'] = round(info['rms'], 6)
+        segment['peak'] = round(info['peak'], 6)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Não foi possível inspecionar {segment_path}: {str(e)}. Usando duração de {fallback_duration:.3f}s")
+        duration = fallback_duration
+    
+    segment['end_time'] = start_time + duration
+    segment['duration'] = duration
+    return segment
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def save_upload_with_hash(file, file_path):
+    """Grava um upload em disco calculando o SHA-256 do conteúdo na mesma passada."""
+    digest = hashlib.sha256()
+    with open(file_path, 'wb') as out:
+        for chunk in iter(lambda: file.stream.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            out.write(chunk)
+    return digest.hexdigest()
+
+def hash_file(file_path):
+    """Calcula o SHA-256 de um arquivo já gravado."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_preprocessing_settings():
+    """Configurações que determinam os segmentos gerados a partir de um áudio."""
+    return {
+        'segment_duration': SEGMENT_DURATION,
+        'audio_filters': AUDIO_FILTERS,
+        'segment_boundaries': segment_boundaries,
+        'silence_search_window': silence_search_window if segment_boundaries == 'silence' else None
+    }
+
+def find_duplicate_session(session_id, content_hash, settings):
+    """Procura uma sessão concluída com o mesmo conteúdo e as mesmas configurações."""
     try:
+        response = requests.get(f"{TRANSCRIPTION_SERVICE_URL}/settings", timeout=5)
+        if response.status_code != 200:
+            return None
+        transcription_settings = response.json()
+    except (requests.RequestException, ValueError) as e:
+        logger.warning(f"Deduplicação ignorada, configurações de transcrição indisponíveis: {str(e)}")
+        return None
+    
+    best = None
+    for filename in os.listdir(app.config['DATA_FOLDER']):
+        if not filename.endswith('.json') or filename == f"{session_id}.json":
+            continue
+        try:
+            with open(os.path.join(app.config['DATA_FOLDER'], filename), 'r') as f:
+                candidate = json.load(f)
+        except (OSError, ValueError):
+            continue
+        
+        if (candidate.get('content_hash') == content_hash
+                and candidate.get('status') == 'completed'
+                and candidate.get('transcript')
+                and candidate.get('preprocessing_settings') == settings
+                and candidate.get('transcription_settings') == transcription_settings):
+            if best is None or candidate.get('completion_time', '') > best.get('completion_time', ''):
+                best = candidate
+    return best
+
+def link_duplicate_session(job_id, session_id, source):
+    """Aponta a nova sessão para os segmentos e a transcrição de uma sessão idêntica."""
+    source_id = source['session_id']
+    logger.info(f"Sessão {session_id} tem o mesmo conteúdo da sessão {source_id}; reaproveitando segmentos e transcrição")
+    segments = source.get('segments', [])
+    update_session_status(
+        session_id,
+        'completed',
+        deduplicated_from=source_id,
+        preprocessing_completed=datetime.now().isoformat(),
+        segments=segments,
+        transcript=source['transcript'],
+        transcription_settings=source.get('transcription_settings'),
+        total_segments=len(segments),
+        segments_processed=len(segments),
+        segments_completed=len(segments),
+        progress=1.0,
+        completion_time=datetime.now().isoformat()
+    )
+    update_job(
+        job_id,
+        status='completed',
+        stage='deduplicated',
+        progress=1.0,
+        segments_count=len(segments),
+        deduplicated_from=source_id,
+        finished_at=datetime.now().isoformat()
+    )
+
+def run_preprocessing_job(job_id, session_id, file_path, content_hash=None):
+    """Executa a segmentação e o envio para transcrição de um job.
+    
+    Roda no executor em segundo plano; o progresso fica em `jobs[job_id]`.
+    """
+    update_job(job_id, status='running', stage='segmenting', started_at=datetime.now().isoformat())
+    
+    try:
+        # Reaproveitar uma sessão concluída com o mesmo áudio e as mesmas configurações
+        if content_hash is None:
+            update_job(job_id, stage='hashing')
+            content_hash = hash_file(file_path)
+        settings = get_preprocessing_settings()
+        update_session_status(session_id, None, content_hash=content_hash, preprocessing_settings=settings)
+        
+        source = find_duplicate_session(session_id, content_hash, settings)
+        if source is not None:
+            link_duplicate_session(job_id, session_id, source)
+            return
+        
         # Criar diretório para os segmentos processados
         session_dir = os.path.join(app.config['DATA_FOLDER'], session_id)
         os.makedirs(session_dir, exist_ok=True)
@@ -116,58 +592,25 @@ def preprocess_audio():
         logger.info(f"Iniciando segmentação do áudio para a sessão {session_id}")
         update_session_status(session_id, 'preprocessing', status_detail='Segmentando áudio')
         
-        # Padrão para os arquivos de segmento (usando WAV para melhor compatibilidade com PCM)
-        segment_pattern = os.path.join(session_dir, "segment_%03d.wav")
-        
-        # Comando FFmpeg para segmentar o áudio com pré-processamento para melhorar a qualidade da transcrição
-        command = [
-            "ffmpeg", "-y", "-i", file_path,
-            # Filtros de áudio para melhorar a qualidade da transcrição
-            "-af", "highpass=f=200,lowpass=f=3000,volume=1.5,dynaudnorm",
-            # Configuração de segmentação
-            "-f", "segment", "-segment_time", "900",  # 15 minutos
-            # Configuração de áudio otimizada para Whisper
-            "-c:a", "pcm_s16le",  # Formato PCM 16-bit (melhor para transcrição)
-            "-ac", "1",  # Mono
-            "-ar", "16000",  # 16kHz (ideal para Whisper)
-            segment_pattern
-        ]
+        if pipelined_handoff:
+            run_pipelined_handoff(job_id, session_id, file_path, session_dir)
+            return
         
-        # Executar o comando
-        subprocess.run(command, check=True)
+        # Gerar os arquivos segment_%03d.wav no diretório da sessão, registrando o início real de cada um
+        boundaries = []
+        segment_audio(file_path, session_dir, lambda index, filename, start, end: boundaries.append((index, filename, start)))
+        update_job(job_id, stage='inspecting', progress=0.5)
         
-        # Listar os segmentos gerados
-        segments = []
-        for i, filename in enumerate(sorted([f for f in os.listdir(session_dir) if f.startswith("segment_") and f.endswith(".wav")])):
-            segment_path = os.path.join(session_dir, filename)
-            
-            # Obter duração do segmento
-            try:
-                result = subprocess.run(
-                    ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', segment_path],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True
-                )
-                duration = float(result.stdout.strip())
-            except Exception:
-                duration = 900  # Valor padrão de 15 minutos
-            
-            # Calcular tempo de início do segmento
-            start_time = i * 900  # 15 minutos por segmento
-            
-            segments.append({
-                'index': i,
-                'filename': filename,
-                'path': segment_path,
-                'start_time': start_time,
-                'end_time': start_time + duration,
-                'duration': duration
-            })
+        # Montar os segmentos gerados
+        segments = [
+            build_segment(index, filename, os.path.join(session_dir, filename), start_time)
+            for index, filename, start_time in boundaries
+        ]
         
         if not segments:
             update_session_status(session_id, 'error', error_message='No segments generated')
-            return jsonify({'error': 'No segments generated'}), 500
+            update_job(job_id, status='failed', stage='segmenting', error='No segments generated')
+            return
         
         # Atualizar metadados da sessão
         update_session_status(
@@ -176,6 +619,7 @@ def preprocess_audio():
             preprocessing_completed=datetime.now().isoformat(),
             segments=segments
         )
+        update_job(job_id, stage='dispatching', progress=0.9, segments_count=len(segments))
         
         # Enviar para o serviço de transcrição automaticamente
         try:
@@ -194,7 +638,8 @@ def preprocess_audio():
                     'error', 
                     error_message=f'Failed to send to transcription service: {response.text}'
                 )
-                return jsonify({'error': 'Failed to send to transcription service'}), 500
+                update_job(job_id, status='failed', error='Failed to send to transcription service')
+                return
                 
             # Atualizar status para 'transcribing'
             update_session_status(session_id, 'transcribing')
@@ -205,24 +650,116 @@ def preprocess_audio():
                 'preprocessed',  # Manter como preprocessed para permitir retry
                 error_message=f'Error connecting to transcription service: {str(e)}'
             )
-            return jsonify({
-                'status': 'preprocessed',
-                'warning': f'Error connecting to transcription service: {str(e)}',
-                'session_id': session_id,
-                'segments_count': len(segments)
-            })
+            update_job(
+                job_id,
+                status='completed',
+                stage='preprocessed',
+                progress=1.0,
+                warning=f'Error connecting to transcription service: {str(e)}',
+                finished_at=datetime.now().isoformat()
+            )
+            return
         
-        return jsonify({
-            'status': 'success',
-            'message': 'Audio preprocessing completed and sent to transcription service',
-            'session_id': session_id,
-            'segments_count': len(segments)
-        })
+        update_job(job_id, status='completed', stage='transcribing', progress=1.0, finished_at=datetime.now().isoformat())
+        logger.info(f"Job {job_id}: pré-processamento concluído e enviado para transcrição ({len(segments)} segmentos)")
         
     except Exception as e:
         logger.error(f"Error during preprocessing: {str(e)}")
         update_session_status(session_id, 'error', error_message=str(e))
-        return jsonify({'error': f'Error during preprocessing: {str(e)}'}), 500
+        update_job(job_id, status='failed', error=f'Error during preprocessing: {str(e)}', finished_at=datetime.now().isoformat())
+
+def run_pipelined_handoff(job_id, session_id, file_path, session_dir):
+    """Segmenta o áudio enviando cada segmento à transcrição assim que fica pronto.
+    
+    Enquanto o FFmpeg ainda codifica os próximos segmentos, o Whisper já
+    trabalha nos anteriores. Ao final, /transcribe/finalize informa o total.
+    """
+    segments = []
+    dispatch_errors = []
+    dispatched = 0
+    
+    def on_segment(index, filename, start, end):
+        nonlocal dispatched
+        segment = build_segment(index, filename, os.path.join(session_dir, filename), start, end - start)
+        segments.append(segment)
+        update_job(job_id, stage='segmenting', segments_count=len(segments))
+        
+        # Depois da primeira falha, apenas continuar segmentando
+        if dispatch_errors:
+            return
+        try:
+            response = requests.post(
+                f"{TRANSCRIPTION_SERVICE_URL}/transcribe/segment",
+                json={'session_id': session_id, 'segment': segment},
+                timeout=60
+            )
+            if response.status_code != 200:
+                logger.error(f"Error sending segment {index} to transcription service: {response.text}")
+                dispatch_errors.append(response.text)
+                return
+        except requests.RequestException as e:
+            logger.error(f"Error connecting to transcription service: {str(e)}")
+            dispatch_errors.append(str(e))
+            return
+        # Contar só depois que a transcrição aceitou o segmento
+        dispatched += 1
+        update_job(job_id, segments_dispatched=dispatched)
+    
+    segment_audio(file_path, session_dir, on_segment)
+    
+    if not segments:
+        update_session_status(session_id, 'error', error_message='No segments generated')
+        update_job(job_id, status='failed', stage='segmenting', error='No segments generated')
+        return
+    
+    if dispatch_errors:
+        update_session_status(
+            session_id,
+            'preprocessed',  # Manter como preprocessed para permitir retry
+            preprocessing_completed=datetime.now().isoformat(),
+            segments=segments,
+            error_message=f'Error sending segments to transcription service: {dispatch_errors[0]}'
+        )
+        update_job(
+            job_id,
+            status='completed',
+            stage='preprocessed',
+            progress=1.0,
+            warning=f'Error sending segments to transcription service: {dispatch_errors[0]}',
+            finished_at=datetime.now().isoformat()
+        )
+        return
+    
+    # A transcrição grava os metadados a partir daqui; o total fecha a sessão
+    try:
+        response = requests.post(
+            f"{TRANSCRIPTION_SERVICE_URL}/transcribe/finalize",
+            json={
+                'session_id': session_id,
+                'total_segments': len(segments),
+                'segments': segments,
+                'preprocessing_completed': datetime.now().isoformat()
+            },
+            timeout=60
+        )
+        if response.status_code != 200:
+            raise requests.RequestException(response.text)
+    except requests.RequestException as e:
+        logger.error(f"Error finalizing transcription for session {session_id}: {str(e)}")
+        update_job(job_id, status='failed', error=f'Failed to finalize transcription: {str(e)}', finished_at=datetime.now().isoformat())
+        return
+    
+    update_job(job_id, status='completed', stage='transcribing', progress=1.0, finished_at=datetime.now().isoformat())
+    logger.info(f"Job {job_id}: {len(segments)} segmentos enviados em pipeline para transcrição")
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Retorna o progresso de um job de pré-processamento."""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(dict(job))
 
 @app.route('/health', methods=['GET'])
 def health_check():
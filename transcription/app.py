@@ -1,14 +1,23 @@
 import os
+import re
 import json
 import logging
 import time
 import torch
-import whisper
 import threading
 import subprocess
+import multiprocessing
+import numpy as np
 from queue import Queue, Empty as QueueEmpty
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
 from flask import Flask, request, jsonify
 from datetime import datetime
+from audio_inspect import inspect_wav, load_pcm16, speech_regions
+from engines import create_engine
+from batched_decode import EncoderCache
+from repetitions import collapse_repetitions
+from job_queue import DurableJobQueue
 
 app = Flask(__name__)
 app.config['DATA_FOLDER'] = os.environ.get('DATA_FOLDER', '/app/data')
@@ -21,14 +30,126 @@ logger = logging.getLogger(__name__)
 os.makedirs(app.config['DATA_FOLDER'], exist_ok=True)
 
 # Global variables
-model = None
 model_name = os.environ.get('WHISPER_MODEL', 'medium')  # Alterado para 'medium' conforme solicitado
-model_lock = threading.Lock()
-processing_queue = Queue(maxsize=200)  # Aumentamos a capacidade da fila
+engine_name = os.environ.get('WHISPER_ENGINE', 'whisper')  # whisper, ctranslate2 ou stub (ver engines.py)
+ct2_compute_type = os.environ.get('CT2_COMPUTE_TYPE', 'int8')
+ct2_model_dir = os.environ.get('CT2_MODEL_DIR', '/root/.cache/whisper/ctranslate2')
+engine_warmup = os.environ.get('ENGINE_WARMUP', 'true').lower() == 'true'
+# 'int8': quantização dinâmica das camadas Linear (apenas motor whisper em CPU)
+whisper_quantize = os.environ.get('WHISPER_QUANTIZE', 'none').lower()
+quantized_model_dir = os.environ.get('QUANTIZED_MODEL_DIR', '/root/.cache/whisper')
+# Modelos carregados, chaveados por (tamanho, dispositivo), em ordem de uso (LRU)
+model_cache = OrderedDict()
+model_cache_budget = int(os.environ.get('MODEL_CACHE_MB', 4096)) * 1024 * 1024  # Orçamento por cache
+# Protege o cache global, compartilhado pelo worker 0 e pelas threads de requisição do Flask (reentrante: fallback)
+model_lock = threading.RLock()
+# Modelo que substitui um que não carregou: (tamanho, dispositivo) -> tamanho do fallback
+model_fallbacks = {}
+# Pós-processamento (limpeza do texto e gravação na sessão) fora dos workers que seguram o modelo
+postprocess_queue = Queue(maxsize=200)
+postprocess_batch_size = int(os.environ.get('POSTPROCESS_BATCH_SIZE', 16))  # Segmentos por gravação na sessão
+postprocess_thread = None
+postprocess_stats = {'segments': 0, 'phrases': 0, 'batches': 0, 'failed': 0, 'busy_seconds': 0.0, 'wait_seconds': 0.0}
 worker_threads = []
-max_workers = 1  # Alterado para 1 para processamento sequencial
+max_workers = max(1, int(os.environ.get('TRANSCRIPTION_WORKERS', 1)))  # 1 = processamento sequencial
+# Threads intra-op do torch divididas entre os workers para não disputar os núcleos
+torch_threads_total = int(os.environ.get('TORCH_THREADS', os.cpu_count() or 1))
+torch_threads_per_worker = max(1, torch_threads_total // max_workers)
+torch.set_num_threads(torch_threads_per_worker)
+# Cada worker guarda aqui a sua própria instância do modelo
+worker_state = threading.local()
+# Estado de cada worker (índice -> status, segmento atual, contadores) para o /health
+worker_stats = {}
+# 'thread': workers decodificam no próprio processo do Flask
+# 'process': cada worker despacha os segmentos para um processo filho com o modelo carregado
+execution_mode = os.environ.get('EXECUTION_MODE', 'thread').lower()
+worker_processes = {}  # índice do worker -> {'process', 'conn', 'restarts'}
+# Um pedido por vez em cada processo filho: o worker e o refinamento compartilham o Pipe
+worker_process_locks = {}
+segment_crashes = {}  # "<session_id>_<index>" -> quantas vezes o processo morreu com o segmento
 max_retries = int(os.environ.get('MAX_RETRIES', 5))  # Aumentamos o número de tentativas
 retry_delay = int(os.environ.get('RETRY_DELAY', 2))
+# Fila de segmentos persistida no volume de dados (ver job_queue.py): sobrevive a reinícios do serviço.
+# Um segmento sem confirmação volta para a fila JOB_VISIBILITY_TIMEOUT segundos após o worker parar de renovar
+job_queue_path = os.environ.get('JOB_QUEUE_PATH', os.path.join(app.config['DATA_FOLDER'], 'transcription_queue.sqlite3'))
+job_visibility_timeout = float(os.environ.get('JOB_VISIBILITY_TIMEOUT', 900))
+# Segmentos transferidos ao pós-processamento sem confirmação depois disso voltam para a fila
+job_detached_timeout = float(os.environ.get('JOB_DETACHED_TIMEOUT', 3600))
+# Uma concessão a mais que as quedas toleradas: requeue_crashed_segment desiste antes da fila
+processing_queue = DurableJobQueue(job_queue_path, maxsize=200, visibility_timeout=job_visibility_timeout,
+                                   max_attempts=max_retries + 1, detached_timeout=job_detached_timeout,
+                                   on_dead=lambda session_id, index, error: record_abandoned_segment(
+                                       session_id, index, f"Segmento descartado pela fila: {error}"))
+# Na inicialização, reenfileirar os segmentos que faltam nas sessões interrompidas
+recover_sessions_on_startup = os.environ.get('RECOVER_SESSIONS_ON_STARTUP', 'true').lower() == 'true'
+recovery_thread = None
+
+# Detecção de atividade de voz: enviar ao Whisper apenas os trechos com fala
+vad_enabled = os.environ.get('VAD_ENABLED', 'true').lower() == 'true'
+vad_threshold_db = float(os.environ['VAD_THRESHOLD_DB']) if os.environ.get('VAD_THRESHOLD_DB') else None
+vad_max_speech_ratio = float(os.environ.get('VAD_MAX_SPEECH_RATIO', 0.9))  # Acima disso, enviar o segmento inteiro
+
+# Encoder em lote sobre as janelas de 30 s do segmento (ver batched_decode.py)
+batched_decoding = os.environ.get('BATCHED_DECODING', 'false').lower() == 'true'
+decode_batch_size = int(os.environ.get('DECODE_BATCH_SIZE', 8))
+# Features do encoder guardadas durante o job de um segmento, para as novas tentativas
+encoder_cache_max_bytes = int(os.environ.get('ENCODER_CACHE_MB', 256)) * 1024 * 1024
+# Decodificação adaptativa (requer BATCHED_DECODING): cada janela começa gulosa e só
+# sobe para a busca em feixe quando algum dos limiares abaixo é ultrapassado
+adaptive_decoding = os.environ.get('ADAPTIVE_DECODING', 'false').lower() == 'true'
+adaptive_policy = {
+    'logprob_threshold': float(os.environ.get('ADAPTIVE_LOGPROB_THRESHOLD', -0.5)),
+    'compression_ratio_threshold': float(os.environ.get('ADAPTIVE_COMPRESSION_THRESHOLD', 2.0)),
+    'no_speech_threshold': float(os.environ.get('ADAPTIVE_NO_SPEECH_THRESHOLD', 0.4))
+} if adaptive_decoding else None
+# Janelas decodificadas em cada nível da política adaptativa ('greedy', 'beam')
+decode_tier_counts = {}
+
+# Refinamento em segundo plano: com a fila ociosa, redecodifica as frases de menor
+# confiança com um modelo maior (ou o mesmo, com busca em feixe) e as substitui no lugar
+refine_enabled = os.environ.get('REFINE_ENABLED', 'false').lower() == 'true'
+refine_model_name = os.environ.get('REFINE_MODEL', model_name)
+refine_logprob_threshold = float(os.environ.get('REFINE_LOGPROB_THRESHOLD', -0.8))
+refine_compression_threshold = float(os.environ.get('REFINE_COMPRESSION_THRESHOLD', 2.4))
+refine_max_phrases = int(os.environ.get('REFINE_MAX_PHRASES', 10))  # Frases por rodada
+refine_idle_seconds = float(os.environ.get('REFINE_IDLE_SECONDS', 30))  # Intervalo entre verificações da fila
+refine_padding_seconds = 0.3  # Margem de áudio em volta da frase
+refine_thread = None
+refine_stats = {'phrases_refined': 0, 'phrases_kept': 0, 'phrases_failed': 0}
+
+# Pipeline em duas passadas: 'draft' transcreve a sessão inteira primeiro com um modelo
+# pequeno (quality_tier 'draft') e depois refaz cada segmento com WHISPER_MODEL ('final')
+pipeline_mode = os.environ.get('PIPELINE_MODE', 'single').lower()  # single ou draft
+draft_model_name = os.environ.get('DRAFT_MODEL', 'base')
+upgrade_poll_seconds = float(os.environ.get('UPGRADE_POLL_SECONDS', 10))
+upgrade_thread = None
+upgrade_attempts = {}  # "<session_id>_<index>" -> vezes que o segmento foi enviado para a versão final
+
+# Frases do prompt que o Whisper às vezes reproduz na transcrição e que devem ser removidas.
+# PROMPT_PHRASES substitui a lista padrão (frases separadas por '|')
+DEFAULT_PROMPT_PHRASES = [
+    "Esta é uma transcrição em português brasileiro",
+    "Transcreva este áudio em português brasileiro",
+    "Esta é uma transcrição em português brasileiro de uma sessão legislativa",
+    "Transcrição em português brasileiro",
+    "Áudio em português brasileiro"
+]
+prompt_phrases = [phrase.strip() for phrase in os.environ['PROMPT_PHRASES'].split('|') if phrase.strip()] \
+    if os.environ.get('PROMPT_PHRASES') else DEFAULT_PROMPT_PHRASES
+
+def compile_prompt_pattern(phrases):
+    """Uma única expressão, sem distinção de maiúsculas, para todas as frases do prompt.
+    
+    As frases mais longas vêm primeiro na alternância, para que "... de uma sessão
+    legislativa" seja removida inteira, e a pontuação logo após a frase sai junto.
+    """
+    if not phrases:
+        return None
+    alternatives = [r'\s+'.join(re.escape(word) for word in phrase.split())
+                    for phrase in sorted(set(phrases), key=len, reverse=True)]
+    return re.compile(r'(?:' + '|'.join(alternatives) + r')[\s.,;:!?]*', re.IGNORECASE)
+
+prompt_pattern = compile_prompt_pattern(prompt_phrases)
 
 # Dicionário para rastrear o estado de processamento de cada segmento
 segment_processing_status = {}
@@ -51,10 +172,21 @@ def format_time(seconds):
     else:
         return f"{minutes:02d}:{seconds:02d}"
 
-def update_session_status(session_id, status, **kwargs):
+def write_session_file(metadata_path, metadata):
+    """Grava o JSON da sessão de forma atômica: leitores nunca veem o arquivo pela metade."""
+    temp_path = f"{metadata_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(temp_path, metadata_path)
+
+def update_session_status(session_id, status, update=None, **kwargs):
     """Update the session metadata with new status and additional information.
     Garante que todos os segmentos sejam salvos corretamente no arquivo JSON.
     Implementa mecanismo robusto para evitar corridas de condição e perda de dados.
+    `update(metadata)`, se informado, é chamado com o JSON recém-lido, ainda com o
+    bloqueio, e retorna campos extras (e, opcionalmente, 'status'): contadores e
+    listas que dependem do valor atual são calculados sem perder gravações concorrentes.
+    Também pode alterar ou remover campos de `metadata` diretamente.
     """
     metadata_path = os.path.join(app.config['DATA_FOLDER'], f"{session_id}.json")
     
@@ -107,8 +239,13 @@ def update_session_status(session_id, status, **kwargs):
                     time.sleep(retry_delay * (retry + 1))  # Backoff exponencial
                     continue
             
-            # Criar arquivo de bloqueio
-            with open(lock_file, 'w') as f:
+            # Criar arquivo de bloqueio (O_EXCL: só uma thread ou processo consegue criá-lo)
+            try:
+                lock_fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                time.sleep(retry_delay * (retry + 1))
+                continue
+            with os.fdopen(lock_fd, 'w') as f:
                 f.write(f"Locked by process {os.getpid()} at {datetime.now().isoformat()}")
             
             try:
@@ -123,6 +260,10 @@ def update_session_status(session_id, status, **kwargs):
                     else:
                         raise
                 
+                if update is not None:
+                    kwargs = dict(kwargs, **(update(metadata) or {}))
+                    status = kwargs.pop('status', status)
+                
                 # Atualizar status se fornecido
                 if status is not None:
                     metadata['status'] = status
@@ -159,8 +300,9 @@ def update_session_status(session_id, status, **kwargs):
                     progress = metadata['segments_processed'] / metadata['total_segments']
                     metadata['progress'] = progress
                     
-                    # Verificar se a sessão está completa
-                    if metadata['segments_processed'] >= metadata['total_segments'] and metadata.get('status') != 'completed':
+                    # Verificar se a sessão está completa (em modo pipeline, só depois do /transcribe/finalize)
+                    if (metadata['segments_processed'] >= metadata['total_segments'] and metadata.get('status') != 'completed'
+                            and not metadata.get('segments_streaming')):
                         metadata['status'] = 'completed'
                         metadata['completion_time'] = datetime.now().isoformat()
                         logger.info(f"Sessão {session_id} marcada como concluída com {metadata['segments_processed']} segmentos")
@@ -178,8 +320,7 @@ def update_session_status(session_id, status, **kwargs):
                             logger.warning(f"Sessão {session_id} concluída, mas o segmento 0 não foi encontrado. Aplicando transcrição forçada.")
                             try:
                                 # Salvar metadados antes de forçar a transcrição
-                                with open(metadata_path, 'w') as f:
-                                    json.dump(metadata, f, indent=2)
+                                write_session_file(metadata_path, metadata)
                                 
                                 # Remover o bloqueio antes de chamar outra função que pode tentar adquiri-lo
                                 if os.path.exists(lock_file):
@@ -194,8 +335,7 @@ def update_session_status(session_id, status, **kwargs):
                                 logger.error(f"Erro ao forçar transcrição do segmento 0: {str(e)}")
                 
                 # Salvar metadados atualizados
-                with open(metadata_path, 'w') as f:
-                    json.dump(metadata, f, indent=2)
+                write_session_file(metadata_path, metadata)
                 
                 logger.debug(f"Metadados atualizados para sessão {session_id}")
                 return True
@@ -220,35 +360,20 @@ def update_session_status(session_id, status, **kwargs):
     return False
 
 def remove_prompt_text(text):
-    """Remove textos do prompt inicial que podem ter sido incluídos na transcrição."""
-    if not text:
+    """Remove textos do prompt inicial que podem ter sido incluídos na transcrição.
+    
+    Uma única passada com o padrão compilado na carga do módulo; o restante do
+    texto mantém a capitalização original.
+    """
+    if not text or prompt_pattern is None:
         return text
-        
-    # Lista de frases do prompt inicial que devem ser removidas da transcrição
-    prompt_phrases = [
-        "Esta é uma transcrição em português brasileiro",
-        "Transcreva este áudio em português brasileiro",
-        "Esta é uma transcrição em português brasileiro de uma sessão legislativa",
-        "Transcrição em português brasileiro",
-        "Áudio em português brasileiro"
-    ]
-    
-    # Remover frases do prompt que possam ter sido incluídas na transcrição
-    original_text = text
-    for phrase in prompt_phrases:
-        if phrase.lower() in text.lower():
-            # Substituir a frase por espaço em branco
-            text = text.lower().replace(phrase.lower(), "").strip()
-            logger.info(f"Frase do prompt removida da transcrição: '{phrase}'")
-    
-    # Se o texto foi modificado, restaurar a capitalização adequada
-    if text != original_text:
-        # Capitalizar a primeira letra de cada frase
-        sentences = text.split('. ')
-        sentences = [s.capitalize() for s in sentences if s]
-        text = '. '.join(sentences)
-    
-    return text
+    
+    cleaned_text, removed = prompt_pattern.subn('', text)
+    if not removed:
+        return text
+    
+    logger.info(f"{removed} ocorrência(s) de frases do prompt removida(s) da transcrição")
+    return cleaned_text.strip()
 
 def fix_repetitions(text):
     """Detecta e corrige repetições excessivas no texto transcrito."""
@@ -265,39 +390,8 @@ def fix_repetitions(text):
     if len(words) < 5:
         return text
     
-    # Detectar padrões de repetição
-    cleaned_words = []
-    i = 0
-    repetition_detected = False
-    
-    while i < len(words):
-        repetition_found = False
-        
-        # Verificar repetições de frases (2 a 10 palavras)
-        for phrase_length in range(2, min(11, len(words) - i)):
-            phrase = ' '.join(words[i:i+phrase_length])
-            
-            # Procurar a mesma frase mais adiante
-            j = i + phrase_length
-            while j + phrase_length <= len(words):
-                next_phrase = ' '.join(words[j:j+phrase_length])
-                
-                if phrase.lower() == next_phrase.lower():  # Comparação case-insensitive
-                    # Encontrou uma repetição
-                    j += phrase_length
-                else:
-                    break
-            
-            if j > i + phrase_length:  # Se encontrou pelo menos uma repetição
-                i = j  # Avançar para depois das repetições
-                repetition_found = True
-                repetition_detected = True
-                break
-        
-        if not repetition_found:
-            # Se não encontrou repetição, adicionar a palavra atual
-            cleaned_words.append(words[i])
-            i += 1
+    # Detectar padrões de repetição (frases comparadas como fatias da lista de palavras, ver repetitions.py)
+    cleaned_words, repetition_detected = collapse_repetitions(words)
     
     # Reconstruir o texto
     cleaned_text = ' '.join(cleaned_words)
@@ -308,18 +402,55 @@ def fix_repetitions(text):
     
     return cleaned_text
 
-def load_model(model_size=None):
-    """Carrega o modelo Whisper com configurações otimizadas."""
-    global model, model_name
+def get_model_cache():
+    """Cache de modelos do contexto atual.
     
-    # Se já temos um modelo carregado e não foi solicitado um modelo específico, retornar o modelo existente
-    if model is not None and model_size is None:
-        return model
+    A decodificação do Whisper instala hooks de kv-cache no modelo, então uma
+    mesma instância não pode atender dois workers ao mesmo tempo: cada worker
+    tem o seu cache. Fora dos workers (e nos processos filhos) usa-se o global.
+    """
+    cache = getattr(worker_state, 'models', None)
+    return model_cache if cache is None else cache
+
+def evict_models(cache, keep):
+    """Descarta os modelos menos usados até o cache caber no orçamento.
+    O modelo recém-solicitado, o modelo padrão e os fallbacks em uso nunca são descartados."""
+    protected = {model_name} | set(model_fallbacks.values())
+    while sum(entry['bytes'] for entry in cache.values()) > model_cache_budget:
+        victim = next((key for key in cache if key != keep and key[0] not in protected), None)
+        if victim is None:
+            break
+        entry = cache.pop(victim)
+        logger.info(f"Modelo {victim[0]} ({victim[1]}) removido do cache "
+                    f"({entry['bytes'] / (1024**2):.0f} MB liberados)")
+        if victim[1] == "cuda":
+            torch.cuda.empty_cache()
+
+def load_model(model_size=None):
+    """Carrega o modelo Whisper no motor configurado (WHISPER_ENGINE).
     
+    Retorna o motor com o modelo pedido (ou o padrão, WHISPER_MODEL) a partir do
+    cache LRU do contexto atual, carregando-o do disco apenas na primeira vez.
+    Pedir outro tamanho não altera o modelo usado pelos demais segmentos.
+    """
+    cache = get_model_cache()
+    with model_lock if cache is model_cache else nullcontext():
+        return load_model_into(cache, model_size)
+
+def load_model_into(cache, model_size=None):
     requested_model = model_size or model_name
     device = "cuda" if torch.cuda.is_available() else "cpu"
+    key = (requested_model, device)
+    if key in model_fallbacks:
+        # O modelo pedido já falhou ao carregar: usar o fallback sem tentar o disco de novo
+        return load_model_into(cache, model_fallbacks[key])
     
-    logger.info(f"Carregando modelo Whisper {requested_model} no dispositivo {device}")
+    entry = cache.get(key)
+    if entry is not None:
+        cache.move_to_end(key)
+        return entry['model']
+    
+    logger.info(f"Carregando modelo Whisper {requested_model} no dispositivo {device} (motor {engine_name})")
     
     try:
         # Liberar memória se estiver usando GPU
@@ -327,29 +458,39 @@ def load_model(model_size=None):
             torch.cuda.empty_cache()
         
         # Carregar o modelo com tratamento de dispositivo correto
-        loaded_model = whisper.load_model(requested_model, device=device)
-        logger.info(f"Modelo {requested_model} carregado com sucesso")
-        
-        # Configurações específicas para evitar problemas de tensor
-        if hasattr(loaded_model, 'encoder'):
-            loaded_model.encoder.conv1.register_forward_hook(lambda module, input, output: None)
-            logger.info("Hook de forward registrado para evitar problemas de tensor")
-        
-        # Atualizar a variável global model
-        model = loaded_model
-        
-        return loaded_model
+        loaded_model = create_engine(
+            engine_name, requested_model, device,
+            batched=batched_decoding,
+            batch_size=decode_batch_size,
+            compute_type=ct2_compute_type,
+            download_root=ct2_model_dir,
+            quantize=whisper_quantize,
+            quantized_dir=quantized_model_dir,
+            adaptive_policy=adaptive_policy
+        )
+        loaded_model.load()
+        if engine_warmup:
+            loaded_model.warmup()
     except Exception as e:
         logger.error(f"Erro ao carregar modelo {requested_model}: {str(e)}")
         # Se falhar ao carregar o modelo solicitado, tentar carregar um modelo menor
         if requested_model == "medium" and model_size is None:
             logger.info("Tentando carregar modelo 'base' como fallback")
-            return load_model("base")
+            fallback = "base"
         elif requested_model == "base" and model_size is None:
             logger.info("Tentando carregar modelo 'small' como fallback")
-            return load_model("small")
+            fallback = "small"
         else:
             raise
+        # Lembrar o fallback para não tentar o disco a cada segmento; ele fica no cache com o próprio tamanho
+        model_fallbacks[key] = fallback
+        return load_model_into(cache, fallback)
+    
+    cache[key] = {'model': loaded_model, 'bytes': loaded_model.memory_bytes()}
+    evict_models(cache, keep=key)
+    if hasattr(worker_state, 'index'):
+        set_worker_stats(worker_state.index, models=[f"{size}@{dev}" for (size, dev) in cache])
+    return loaded_model
 
 def get_session_data(session_id):
     """Get session metadata."""
@@ -418,14 +559,310 @@ def force_preprocess_audio(audio_path):
         logger.error(f"Erro ao forçar pré-processamento de áudio: {str(e)}")
         return audio_path
 
-def transcribe_segment(segment, session_id, retry_count=0):
+def load_segment_audio(audio_path):
+    """Carrega o segmento como array float32 de 16 kHz para enviar ao Whisper.
+    
+    As amostras são lidas por um numpy.memmap sobre o chunk 'data' do WAV e
+    convertidas para float32 uma única vez, sem FFmpeg. Retorna (audio, time_map):
+    
+    - se o arquivo não for PCM 16-bit mono 16 kHz, `audio` é o próprio caminho
+      e o Whisper decodifica como antes;
+    - com o VAD ativo, `audio` contém apenas os trechos de fala concatenados e
+      `time_map` lista (início no áudio enviado, início no segmento, duração)
+      em segundos; uma lista vazia indica que não há fala no segmento;
+    - sem VAD (ou quando quase tudo é fala), `time_map` é None.
+    
+    O retorno é reaproveitado por todas as tentativas do mesmo segmento.
+    """
+    try:
+        info, samples = load_pcm16(audio_path)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Não foi possível mapear {audio_path} como PCM 16-bit: {str(e)}")
+        return audio_path, None
+    
+    sample_rate = info['sample_rate']
+    if info['channels'] != 1 or sample_rate != 16000 or len(samples) == 0:
+        return audio_path, None
+    
+    if vad_enabled:
+        regions = speech_regions(samples, sample_rate, threshold_db=vad_threshold_db)
+        speech_ratio = sum(end - start for start, end in regions) / len(samples)
+        
+        if speech_ratio <= vad_max_speech_ratio:
+            logger.info(f"VAD: {len(regions)} trechos com fala, {speech_ratio:.1%} do áudio enviado ao modelo")
+            if not regions:
+                return np.zeros(0, dtype=np.float32), []
+            
+            time_map = []
+            gated_start = 0
+            for start, end in regions:
+                time_map.append((gated_start / sample_rate, start / sample_rate, (end - start) / sample_rate))
+                gated_start += end - start
+            
+            audio = np.concatenate([samples[start:end] for start, end in regions]).astype(np.float32)
+            audio /= 32768.0
+            return audio, time_map
+    
+    audio = samples.astype(np.float32)
+    audio /= 32768.0
+    return audio, None
+
+def map_speech_times(time_map, seconds):
+    """Converte tempos do áudio enviado ao modelo para tempos no segmento original (vetorizado)."""
+    seconds = np.asarray(seconds, dtype=np.float64)
+    if not time_map:
+        return seconds
+    table = np.asarray(time_map, dtype=np.float64)
+    index = np.maximum(np.searchsorted(table[:, 0], seconds, side='right') - 1, 0)
+    return table[index, 1] + np.minimum(seconds - table[index, 0], table[index, 2])
+
+# Degraus da escada de tentativas (0 = padrão, 1 = simples, 2 = mínimo)
+RETRY_LADDER_LEVELS = 3
+
+def get_retry_options(retry_count):
+    """Opções de transcrição para cada tentativa: a primeira é a mais precisa, as seguintes mais simples."""
+    if retry_count == 0:
+        # Primeira tentativa para outros segmentos: configurações padrão
+        return {
+            'language': 'pt',  # Portuguese
+            'task': 'transcribe',
+            'verbose': True,  # Ativar verbose para depuração
+            'word_timestamps': False,  # Desativamos timestamps por palavra para evitar erros de dimensão
+            'beam_size': 5,          # Aumenta a precisão da busca por transcrições
+            'best_of': 5,            # Seleciona a melhor entre várias transcrições
+            'temperature': [0.0, 0.2, 0.4],  # Usar múltiplas temperaturas para melhor resultado
+            'fp16': False,            # Desativa FP16 para evitar avisos e problemas em CPU
+            'compression_ratio_threshold': 2.4,
+            'logprob_threshold': -1.0,
+            'no_speech_threshold': 0.6,
+            'condition_on_previous_text': True,  # Considera o contexto anterior para maior coerência
+            'suppress_blank': True,
+            'initial_prompt': "Transcreva este áudio de uma sessão legislativa em português brasileiro com precisão."  # Prompt para melhorar a qualidade
+        }
+    elif retry_count == 1:
+        # Segunda tentativa: configurações mais simples
+        return {
+            'language': 'pt',
+            'task': 'transcribe',
+            'verbose': True,
+            'word_timestamps': False,
+            'beam_size': 1,
+            'best_of': 1,
+            'temperature': [0.0],
+            'fp16': False,
+            'no_speech_threshold': 0.6,
+            'condition_on_previous_text': False,
+            'suppress_blank': True,
+            'initial_prompt': ""
+        }
+    else:
+        # Terceira tentativa: configurações mínimas
+        return {
+            'language': 'pt',
+            'task': 'transcribe',
+            'verbose': True,
+            'word_timestamps': False,
+            'beam_size': 1,
+            'best_of': 1,
+            'temperature': [0.0],
+            'fp16': False,
+            'no_speech_threshold': 0.9,  # Mais tolerante a silêncio
+            'condition_on_previous_text': False,
+            'suppress_blank': True,
+            'initial_prompt': ""
+        }
+
+def run_transcription(engine, audio, time_map, duration, options, window_fallbacks=()):
+    """Executa o motor, sem chamá-lo quando o VAD não encontrou fala no segmento."""
+    if time_map == []:
+        logger.info("Nenhum trecho com fala detectado; segmento não enviado ao modelo")
+        return {
+            'text': "[Trecho sem fala detectada]",
+            'segments': [{'start': 0, 'end': duration, 'text': "[Trecho sem fala detectada]"}],
+            'language': options.get('language', 'pt')
+        }
+    return engine.transcribe(audio, options, encoder_cache=getattr(worker_state, 'encoder_cache', None),
+                             window_fallbacks=window_fallbacks)
+
+def remove_consecutive_duplicates(phrases):
+    """Remove frases consecutivas idênticas."""
+    if not phrases:
+        return []
+    cleaned = [phrases[0]]
+    for phrase in phrases[1:]:
+        if phrase['text'].strip() != cleaned[-1]['text'].strip():
+            cleaned.append(phrase)
+    return cleaned
+
+def format_segment_result(job):
+    """Monta o resultado do segmento a partir da saída bruta do modelo.
+    
+    Converte os tempos de todas as frases de uma vez, corrige repetições e
+    remove o texto do prompt; roda no estágio de pós-processamento.
+    """
+    if job.get('formatted_result'):
+        # Resultado já montado no worker (modelo small do segmento 0)
+        return job['formatted_result']
+    segment = job['segment']
+    result = job['result']
+    raw_segments = result['segments']
+    starts = map_speech_times(job['speech_time_map'], [seg['start'] for seg in raw_segments]) + segment['start_time']
+    ends = map_speech_times(job['speech_time_map'], [seg['end'] for seg in raw_segments]) + segment['start_time']
+    
+    formatted_segments = []
+    for seg, start_secs, end_secs in zip(raw_segments, starts.tolist(), ends.tolist()):
+        start_time = format_time(start_secs)
+        end_time = format_time(end_secs)
+        
+        # Imprimir no formato [HH:MM:SS.mmm --> HH:MM:SS.mmm] texto
+        logger.debug(f"[{start_time}.000 --> {end_time}.000]  {seg['text']}")
+        
+        # Corrigir repetições excessivas no texto
+        original_text = seg['text']
+        # Verificar se o texto não é apenas underscores
+        if original_text.strip() == "______________" or original_text.strip() == "":
+            original_text = "[Trecho sem fala detectada]"  # Substituir por mensagem informativa
+        
+        corrected_text = fix_repetitions(original_text)
+        
+        formatted_segments.append({
+            'text': corrected_text,
+            'original_text': original_text,  # Manter o texto original para referência
+            'start': start_secs,             # Tempo absoluto em segundos
+            'end': end_secs,                 # Tempo absoluto em segundos
+            'start_formatted': start_time,   # Tempo formatado
+            'end_formatted': end_time,       # Tempo formatado
+            'corrected': corrected_text != original_text,  # Indicar se o texto foi corrigido
+            'timestamp': f"[{start_time}.000 --> {end_time}.000]",  # Adicionar timestamp no formato exato do terminal
+            # Confiança do Whisper na janela da frase, usada pelo refinamento em segundo plano
+            'avg_logprob': seg.get('avg_logprob'),
+            'no_speech_prob': seg.get('no_speech_prob'),
+            'compression_ratio': seg.get('compression_ratio')
+        })
+    
+    # Remover frases consecutivas idênticas
+    formatted_segments = remove_consecutive_duplicates(formatted_segments)
+    
+    # Corrigir repetições no texto completo
+    original_full_text = result['text']
+    corrected_full_text = fix_repetitions(original_full_text)
+    
+    formatted_result = {
+        'segment_index': segment['index'],
+        'start_time': segment['start_time'],
+        'end_time': segment['end_time'],
+        'text': corrected_full_text,
+        'original_text': original_full_text,  # Manter o texto original para referência
+        'phrases': formatted_segments,        # Frases com timestamps
+        'language': result.get('language', 'pt'),
+        'corrected': corrected_full_text != original_full_text,  # Indicar se o texto foi corrigido
+        'quality_tier': job['quality_tier'],  # 'draft' (primeira passada) ou 'final'
+        'model': job['model']
+    }
+    if job.get('window_tiers'):
+        # Nível de decodificação de cada janela de 30 s, para ajustar os limiares da política adaptativa
+        formatted_result['window_tiers'] = job['window_tiers']
+    return formatted_result
+
+def save_segment_results(session_id, entries):
+    """Grava na sessão os resultados de vários segmentos com uma única atualização do JSON.
+    
+    `entries` é uma lista de (job, formatted_result). Os contadores são calculados
+    sobre o JSON lido com o bloqueio, para não perder gravações de outras threads.
+    """
+    if not get_session_data(session_id):
+        return
+    
+    def apply_results(metadata):
+        # Transcrição indexada por segmento, já com os novos resultados
+        transcript = {entry.get('segment_index'): entry for entry in metadata.get('transcript') or []}
+        for job, formatted_result in entries:
+            transcript[formatted_result['segment_index']] = formatted_result
+        
+        # Update segments completed count (a versão final substitui o rascunho)
+        segments_completed = metadata.get('segments_completed', 0) + sum(1 for job, _ in entries if not job['upgrading'])
+        segments_total = metadata.get('total_segments', 0)
+        
+        update_kwargs = {
+            'segments_completed': segments_completed,
+            'progress': min(segments_completed / segments_total, 1.0) if segments_total > 0 else metadata.get('progress', 0),
+            'transcript': [formatted_result for _, formatted_result in entries]  # A mesclagem por índice preserva os demais
+        }
+        
+        # Verificar se todos os segmentos têm frases com timestamps
+        missing_phrases_segments = [index for index, seg in sorted(transcript.items(), key=lambda item: item[0] or 0)
+                                    if not seg.get('phrases')]
+        all_segments_have_phrases = not missing_phrases_segments
+        
+        # Se todos os segmentos estão completos e têm frases, marcar como completed
+        # (com os segmentos ainda chegando em modo pipeline, o total não é o definitivo)
+        if (segments_completed >= segments_total and segments_total > 0 and all_segments_have_phrases
+                and not metadata.get('segments_streaming')):
+            update_kwargs['status'] = 'completed'
+            update_kwargs['completion_time'] = datetime.now().isoformat()
+            update_kwargs['all_segments_have_phrases'] = True
+        elif not all_segments_have_phrases:
+            # Caso contrário, não alteramos o status e registramos os segmentos com problemas
+            logger.warning(f"Sessão {session_id}: Segmentos {missing_phrases_segments} não têm frases com timestamps")
+            update_kwargs['missing_phrases_segments'] = missing_phrases_segments
+            update_kwargs['all_segments_have_phrases'] = False
+        if 'status' not in update_kwargs:
+            # Último resultado de uma sessão com segmentos que falharam
+            update_kwargs.update(settle_failed_segments(dict(metadata, transcript=list(transcript.values()))))
+        return update_kwargs
+    
+    update_session_status(session_id, None, update=apply_results)
+
+def settle_failed_segments(metadata):
+    """Encerra com erro a sessão em que todos os segmentos terminaram, mas algum falhou.
+    
+    Retorna os campos a gravar (vazio se ainda houver segmentos pendentes ou chegando).
+    """
+    if metadata.get('segments_streaming') or metadata.get('status') in ('completed', 'error'):
+        return {}
+    expected = set(segment['index'] for segment in metadata.get('segments') or [])
+    transcribed = set(entry.get('segment_index') for entry in metadata.get('transcript') or [])
+    failed = set(error.get('segment_index') for error in metadata.get('errors') or []) - transcribed
+    if not expected or not failed or not expected <= transcribed | failed:
+        return {}
+    return {
+        'status': 'error',
+        'error_message': f"Falha na transcrição dos segmentos {sorted(failed)}",
+        'completion_time': datetime.now().isoformat()
+    }
+
+def record_segment_error(session_id, segment_index, error):
+    """Registra a falha do segmento na lista 'errors' da sessão."""
+    error_info = {
+        'segment_index': segment_index,
+        'error': error,
+        'status': 'error'
+    }
+    
+    def append_error(metadata):
+        errors = (metadata.get('errors') or []) + [error_info]
+        return dict({'errors': errors}, **settle_failed_segments(dict(metadata, errors=errors)))
+    
+    update_session_status(session_id, None, update=append_error)
+
+class WindowRetriesExhausted(ValueError):
+    """Todas as janelas já foram redecodificadas com os degraus de fallback."""
+
+def transcribe_segment(segment, session_id, retry_count=0, audio_buffer=None):
     """Transcribe a single audio segment using Whisper.
     Otimizado para maior resiliência e suporte a áudios longos.
     Tratamento especial para o segmento 0 para garantir que seja sempre processado corretamente.
+    `audio_buffer` é o retorno de load_segment_audio(), reaproveitado entre tentativas.
+    No caminho normal retorna a saída bruta do modelo ('pending_postprocess'), que
+    run_segment() entrega ao estágio de pós-processamento para formatar e gravar.
     """
+    # Sem nível explícito, o segmento vem da primeira passada; 'final' marca o reenvio pelo agendador
+    upgrading = segment.get('quality_tier') == 'final'
+    quality_tier = segment.get('quality_tier') or ('draft' if pipeline_mode == 'draft' else 'final')
+    
     try:
         # Tratamento especial para o segmento 0
-        if segment['index'] == 0 and retry_count == 0:
+        if segment['index'] == 0 and retry_count == 0 and not upgrading:
             # Verificar se já existe uma transcrição para o segmento 0
             session_data = get_session_data(session_id)
             if session_data and 'transcript' in session_data:
@@ -441,7 +878,7 @@ def transcribe_segment(segment, session_id, retry_count=0):
                     return session_data['transcript'][0]  # Retornar o segmento 0 existente
         
         # Load the model if not already loaded
-        whisper_model = load_model()
+        engine = load_model(draft_model_name if quality_tier == 'draft' else None)
         
         # Get audio file path
         audio_path = segment['path']
@@ -449,8 +886,17 @@ def transcribe_segment(segment, session_id, retry_count=0):
         # Log transcription start
         logger.info(f"Transcribing segment {segment['index']} for session {session_id}")
         
-        # Verificar se o arquivo existe e tem tamanho adequado
-        if not os.path.exists(audio_path) or os.path.getsize(audio_path) < 1000:
+        # Verificar se o arquivo existe, tem tamanho adequado e um cabeçalho WAV legível
+        audio_info = None
+        if os.path.exists(audio_path) and os.path.getsize(audio_path) >= 1000:
+            try:
+                audio_info = inspect_wav(audio_path)
+                logger.info(f"Segmento {segment['index']}: {audio_info['duration']:.3f}s, {audio_info['sample_rate']} Hz, "
+                            f"{audio_info['channels']} canal(is), RMS {audio_info['rms']:.4f}, pico {audio_info['peak']:.4f}")
+            except (OSError, ValueError) as inspect_error:
+                logger.error(f"Cabeçalho WAV inválido em {audio_path}: {str(inspect_error)}")
+
+        if audio_info is None:
             logger.error(f"Arquivo de áudio inválido ou muito pequeno: {audio_path}")
             if segment['index'] == 0:
                 # Para o segmento 0, aplicar transcrição forçada em vez de falhar
@@ -470,18 +916,27 @@ def transcribe_segment(segment, session_id, retry_count=0):
             else:
                 raise ValueError(f"Arquivo de áudio inválido ou muito pequeno: {audio_path}")
         
-        # Pré-processar o áudio para o segmento 0 ou se não for a primeira tentativa
-        if segment['index'] == 0 or retry_count > 0:
-            logger.info(f"Aplicando pré-processamento forçado para o segmento {segment['index']}")
-            audio_path = force_preprocess_audio(audio_path)
+        # Carregar o áudio uma única vez; as novas tentativas reaproveitam o mesmo buffer
+        if audio_buffer is None:
+            audio_buffer = load_segment_audio(audio_path)
+            
+            # Só recorrer ao FFmpeg quando o WAV não pôde ser mapeado diretamente
+            if isinstance(audio_buffer[0], str) and (segment['index'] == 0 or retry_count > 0):
+                logger.info(f"Aplicando pré-processamento forçado para o segmento {segment['index']}")
+                audio_buffer = load_segment_audio(force_preprocess_audio(audio_path))
+        audio_input, speech_time_map = audio_buffer
         
         # Configurações de transcrição adaptativas baseadas no número de tentativas e índice do segmento
         if segment['index'] == 0:
             # Para o segmento 0, vamos usar uma abordagem completamente diferente
             try:
-                # Carregar um modelo menor para o segmento problemático
-                small_model = load_model('small')
-                logger.info("Usando modelo 'small' para o segmento 0 que está causando problemas")
+                # Carregar um modelo menor para o segmento problemático (sem trocar o modelo padrão);
+                # a versão final gerada pelo agendador usa o modelo configurado, como os demais segmentos
+                if upgrading:
+                    small_model = load_model()
+                else:
+                    small_model = load_model(draft_model_name if quality_tier == 'draft' else 'small')
+                logger.info(f"Usando modelo '{small_model.model_size}' para o segmento 0 que está causando problemas")
                 
                 # Configurações mínimas para o modelo small
                 small_options = {
@@ -500,8 +955,8 @@ def transcribe_segment(segment, session_id, retry_count=0):
                 }
                 
                 # Tentar transcrever com o modelo small
-                result = small_model.transcribe(audio_path, **small_options)
-                logger.info(f"Transcrição do segmento 0 concluída com modelo small: {result['text'][:100]}...")
+                result = run_transcription(small_model, audio_input, speech_time_map, segment['duration'], small_options)
+                logger.info(f"Transcrição do segmento 0 concluída com o modelo {small_model.model_size}: {result['text'][:100]}...")
                 
                 # Formatar o resultado e continuar o processamento
                 if result and result.get('text'):
@@ -525,50 +980,22 @@ def transcribe_segment(segment, session_id, retry_count=0):
                         'original_text': result['text'],
                         'phrases': formatted_segments,
                         'language': result.get('language', 'pt'),
-                        'corrected': False
+                        'corrected': False,
+                        'quality_tier': quality_tier,
+                        'model': small_model.model_size
                     }
                     
-                    # Atualizar sessão
-                    session_data = get_session_data(session_id)
-                    if session_data:
-                        # Inicializar lista de transcrições se não existir
-                        if 'transcript' not in session_data:
-                            session_data['transcript'] = []
-                        
-                        # Adicionar ou atualizar este segmento na transcrição
-                        segment_exists = False
-                        for i, existing_segment in enumerate(session_data['transcript']):
-                            if existing_segment.get('segment_index') == segment['index']:
-                                session_data['transcript'][i] = formatted_result
-                                segment_exists = True
-                                break
-                        
-                        if not segment_exists:
-                            session_data['transcript'].append(formatted_result)
-                        
-                        # Ordenar transcrição por índice de segmento
-                        session_data['transcript'].sort(key=lambda x: x.get('segment_index', 0))
-                        
-                        # Atualizar contagem de segmentos concluídos
-                        segments_completed = session_data.get('segments_completed', 0) + 1
-                        segments_total = session_data.get('total_segments', 0)
-                        
-                        # Atualizar status da sessão
-                        update_kwargs = {
-                            'segments_completed': segments_completed,
-                            'transcript': session_data['transcript']
-                        }
-                        
-                        # Se todos os segmentos foram processados, marcar como concluído
-                        if segments_completed >= segments_total and segments_total > 0:
-                            update_kwargs['completion_time'] = datetime.now().isoformat()
-                            update_session_status(session_id, 'completed', **update_kwargs)
-                        else:
-                            # Caso contrário, não alteramos o status
-                            update_session_status(session_id, None, **update_kwargs)
-                    
-                    # Retornar o resultado formatado
-                    return formatted_result
+                    # A gravação na sessão fica com o estágio de pós-processamento, como no caminho normal
+                    return {
+                        'pending_postprocess': True,
+                        'segment': segment,
+                        'session_id': session_id,
+                        'formatted_result': formatted_result,
+                        'quality_tier': quality_tier,
+                        'model': small_model.model_size,
+                        'upgrading': upgrading,
+                        'window_tiers': result.get('window_tiers')
+                    }
                 
             except Exception as small_model_error:
                 logger.error(f"Erro ao usar modelo small para o segmento 0: {str(small_model_error)}")
@@ -589,68 +1016,28 @@ def transcribe_segment(segment, session_id, retry_count=0):
                 'suppress_blank': True,
                 'initial_prompt': ""
             }
-        elif retry_count == 0:
-            # Primeira tentativa para outros segmentos: configurações padrão
-            transcription_options = {
-                'language': 'pt',  # Portuguese
-                'task': 'transcribe',
-                'verbose': True,  # Ativar verbose para depuração
-                'word_timestamps': False,  # Desativamos timestamps por palavra para evitar erros de dimensão
-                'beam_size': 5,          # Aumenta a precisão da busca por transcrições
-                'best_of': 5,            # Seleciona a melhor entre várias transcrições
-                'temperature': [0.0, 0.2, 0.4],  # Usar múltiplas temperaturas para melhor resultado
-                'fp16': False,            # Desativa FP16 para evitar avisos e problemas em CPU
-                'compression_ratio_threshold': 2.4,
-                'logprob_threshold': -1.0,
-                'no_speech_threshold': 0.6,
-                'condition_on_previous_text': True,  # Considera o contexto anterior para maior coerência
-                'suppress_blank': True,
-                'initial_prompt': "Transcreva este áudio de uma sessão legislativa em português brasileiro com precisão."  # Prompt para melhorar a qualidade
-            }
-        elif retry_count == 1:
-            # Segunda tentativa: configurações mais simples
-            transcription_options = {
-                'language': 'pt',
-                'task': 'transcribe',
-                'verbose': True,
-                'word_timestamps': False,
-                'beam_size': 1,
-                'best_of': 1,
-                'temperature': [0.0],
-                'fp16': False,
-                'no_speech_threshold': 0.6,
-                'condition_on_previous_text': False,
-                'suppress_blank': True,
-                'initial_prompt': ""
-            }
         else:
-            # Terceira tentativa: configurações mínimas
-            transcription_options = {
-                'language': 'pt',
-                'task': 'transcribe',
-                'verbose': True,
-                'word_timestamps': False,
-                'beam_size': 1,
-                'best_of': 1,
-                'temperature': [0.0],
-                'fp16': False,
-                'no_speech_threshold': 0.9,  # Mais tolerante a silêncio
-                'condition_on_previous_text': False,
-                'suppress_blank': True,
-                'initial_prompt': ""
-            }
+            transcription_options = get_retry_options(retry_count)
+        
+        # No modo em lote, uma janela que falhar é redecodificada sozinha com os próximos degraus
+        window_fallbacks = [get_retry_options(level) for level in range(max(retry_count, 0) + 1, RETRY_LADDER_LEVELS)]
         
         # Transcribe
-        result = whisper_model.transcribe(audio_path, **transcription_options)
+        result = run_transcription(engine, audio_input, speech_time_map, segment['duration'], transcription_options,
+                                   window_fallbacks)
         
         # Verificar se o resultado contém texto válido
         if not result or not result.get('text') or result.get('text').strip() == "" or result.get('text').strip() == "______________":
             logger.error(f"Transcrição falhou para o segmento {segment['index']}: texto vazio ou inválido")
+            if result and 'window_attempts' in result:
+                # Cada janela já passou por todos os degraus; repetir os 900 s não muda o resultado
+                raise WindowRetriesExhausted(f"Nenhuma janela do segmento {segment['index']} produziu texto "
+                                             f"após {max(result['window_attempts'], default=0)} tentativas")
             # Tentar novamente com configurações diferentes se ainda não atingiu o máximo de tentativas
             if retry_count < max_retries:
                 logger.info(f"Tentando novamente com configurações diferentes (tentativa {retry_count + 1})")
                 # Alterar configurações para próxima tentativa
-                return transcribe_segment(segment, session_id, retry_count + 1)
+                return transcribe_segment(segment, session_id, retry_count + 1, audio_buffer)
             else:
                 # Se atingiu o máximo de tentativas, retornar erro
                 raise ValueError(f"Falha na transcrição após {max_retries} tentativas")
@@ -658,119 +1045,24 @@ def transcribe_segment(segment, session_id, retry_count=0):
         # Log do texto transcrito para depuração
         logger.info(f"Texto transcrito para segmento {segment['index']}: {result['text'][:100]}...")
         
-        # Format the result with timestamps por frases e corrigir repetições
-        formatted_segments = []
-
-        # Função para remover frases consecutivas idênticas
-        def remove_consecutive_duplicates(phrases):
-            if not phrases:
-                return []
-            cleaned = [phrases[0]]
-            for phrase in phrases[1:]:
-                if phrase['text'].strip() != cleaned[-1]['text'].strip():
-                    cleaned.append(phrase)
-            return cleaned
-        
-        # Imprimir os segmentos com timestamps no log para depuração
-        for seg in result['segments']:
-            start_secs = seg['start'] + segment['start_time']
-            end_secs = seg['end'] + segment['start_time']
-            start_time = format_time(start_secs)
-            end_time = format_time(end_secs)
-            
-            # Imprimir no formato [HH:MM:SS.mmm --> HH:MM:SS.mmm] texto
-            logger.info(f"[{start_time}.000 --> {end_time}.000]  {seg['text']}")
-            
-            # Corrigir repetições excessivas no texto
-            original_text = seg['text']
-            # Verificar se o texto não é apenas underscores
-            if original_text.strip() == "______________" or original_text.strip() == "":
-                original_text = "[Trecho sem fala detectada]"  # Substituir por mensagem informativa
-            
-            corrected_text = fix_repetitions(original_text)
-            
-            formatted_segments.append({
-                'text': corrected_text,
-                'original_text': original_text,  # Manter o texto original para referência
-                'start': start_secs,             # Tempo absoluto em segundos
-                'end': end_secs,                 # Tempo absoluto em segundos
-                'start_formatted': start_time,   # Tempo formatado
-                'end_formatted': end_time,       # Tempo formatado
-                'corrected': corrected_text != original_text,  # Indicar se o texto foi corrigido
-                'timestamp': f"[{start_time}.000 --> {end_time}.000]"  # Adicionar timestamp no formato exato do terminal
-            })
-        
-        # Remover frases consecutivas idênticas
-        formatted_segments = remove_consecutive_duplicates(formatted_segments)
-        
-        # Corrigir repetições no texto completo
-        original_full_text = result['text']
-        corrected_full_text = fix_repetitions(original_full_text)
-        
-        formatted_result = {
-            'segment_index': segment['index'],
-            'start_time': segment['start_time'],
-            'end_time': segment['end_time'],
-            'text': corrected_full_text,
-            'original_text': original_full_text,  # Manter o texto original para referência
-            'phrases': formatted_segments,        # Frases com timestamps
-            'language': result.get('language', 'pt'),
-            'corrected': corrected_full_text != original_full_text  # Indicar se o texto foi corrigido
+        # A limpeza do texto e a gravação na sessão ficam com o estágio de pós-processamento,
+        # e o worker segue para o próximo segmento
+        return {
+            'pending_postprocess': True,
+            'segment': segment,
+            'session_id': session_id,
+            'result': {
+                'text': result['text'],
+                'language': result.get('language', 'pt'),
+                # Os tokens não são usados depois da decodificação
+                'segments': [{key: value for key, value in seg.items() if key != 'tokens'} for seg in result['segments']]
+            },
+            'speech_time_map': speech_time_map,
+            'quality_tier': quality_tier,
+            'model': engine.model_size,
+            'upgrading': upgrading,
+            'window_tiers': result.get('window_tiers')
         }
-        
-        # Update session data
-        session_data = get_session_data(session_id)
-        if session_data:
-            # Initialize transcript list if it doesn't exist
-            if 'transcript' not in session_data:
-                session_data['transcript'] = []
-            
-            # Add or update this segment in the transcript
-            segment_exists = False
-            for i, existing_segment in enumerate(session_data['transcript']):
-                if existing_segment.get('segment_index') == segment['index']:
-                    session_data['transcript'][i] = formatted_result
-                    segment_exists = True
-                    break
-            
-            if not segment_exists:
-                session_data['transcript'].append(formatted_result)
-            
-            # Sort transcript by segment index
-            session_data['transcript'].sort(key=lambda x: x.get('segment_index', 0))
-            
-            # Update segments completed count
-            segments_completed = session_data.get('segments_completed', 0) + 1
-            segments_total = session_data.get('segments_total', 0)
-            
-            # Update session status
-            update_kwargs = {
-                'segments_completed': segments_completed,
-                'transcript': session_data['transcript']
-            }
-            
-            # Verificar se todos os segmentos têm frases com timestamps
-            all_segments_have_phrases = True
-            missing_phrases_segments = []
-            
-            for seg in session_data['transcript']:
-                if not seg.get('phrases') or len(seg.get('phrases', [])) == 0:
-                    all_segments_have_phrases = False
-                    missing_phrases_segments.append(seg.get('segment_index', -1))
-            
-            # Se todos os segmentos estão completos e têm frases, marcar como completed
-            if segments_completed >= segments_total and all_segments_have_phrases:
-                update_kwargs['completion_time'] = datetime.now().isoformat()
-                update_kwargs['all_segments_have_phrases'] = True
-                update_session_status(session_id, 'completed', **update_kwargs)
-            else:
-                # Caso contrário, não alteramos o status e registramos os segmentos com problemas
-                if not all_segments_have_phrases:
-                    logger.warning(f"Sessão {session_id}: Segmentos {missing_phrases_segments} não têm frases com timestamps")
-                    update_kwargs['missing_phrases_segments'] = missing_phrases_segments
-                    update_kwargs['all_segments_have_phrases'] = False
-                update_session_status(session_id, None, **update_kwargs)
-        return formatted_result
     
     except Exception as e:
         error_message = str(e)
@@ -780,7 +1072,7 @@ def transcribe_segment(segment, session_id, retry_count=0):
         tensor_dimension_error = "size of tensor" in error_message and "must match" in error_message
         
         # Retry logic
-        if retry_count < max_retries:
+        if retry_count < max_retries and not isinstance(e, WindowRetriesExhausted):
             # Se for erro de dimensão, usar pré-processamento específico
             if tensor_dimension_error:
                 logger.info(f"Detectado erro de dimensão de tensor. Usando pré-processamento específico para o segmento {segment['index']}")
@@ -805,36 +1097,427 @@ def transcribe_segment(segment, session_id, retry_count=0):
                     # Executar o comando
                     subprocess.run(command, check=True, capture_output=True)
                     
-                    # Atualizar o caminho do segmento
+                    # Atualizar o caminho do segmento e recarregar o áudio corrigido
                     segment['path'] = temp_path
+                    audio_buffer = None
                     logger.info(f"Áudio pré-processado salvo em {temp_path}")
                 except Exception as preprocess_error:
                     logger.error(f"Erro ao pré-processar áudio para corrigir dimensão: {str(preprocess_error)}")
             
             logger.info(f"Retrying transcription for segment {segment['index']} (attempt {retry_count + 1})")
             time.sleep(retry_delay)  # Wait before retrying
-            return transcribe_segment(segment, session_id, retry_count + 1)
+            return transcribe_segment(segment, session_id, retry_count + 1, audio_buffer)
         else:
             # Update session with error for this segment
-            error_info = {
-                'segment_index': segment['index'],
-                'error': str(e),
-                'status': 'error'
-            }
-            
-            # Add error info to session
-            session_data = get_session_data(session_id)
-            if session_data:
-                if 'errors' not in session_data:
-                    session_data['errors'] = []
-                session_data['errors'].append(error_info)
-                update_session_status(session_id, None, errors=session_data['errors'])
+            if get_session_data(session_id):
+                record_segment_error(session_id, segment['index'], str(e))
+
+def processing_mode():
+    return 'sequential' if max_workers == 1 else 'parallel'
+
+def set_worker_stats(worker_index, **kwargs):
+    with status_lock:
+        worker_stats.setdefault(worker_index, {'segments_processed': 0, 'segments_failed': 0}).update(kwargs)
+
+def count_segment_result(worker_index, failed=False, result=None):
+    """Atualiza os contadores globais e do worker (os workers rodam em paralelo)."""
+    global segments_processed, segments_failed
+    key = 'segments_failed' if failed else 'segments_processed'
+    with status_lock:
+        if failed:
+            segments_failed += 1
+        else:
+            segments_processed += 1
+        stats = worker_stats.setdefault(worker_index, {'segments_processed': 0, 'segments_failed': 0})
+        stats[key] += 1
+        # O resultado volta do processo filho, então a contagem funciona nos dois modos de execução
+        if isinstance(result, dict):
+            for tier in result.get('window_tiers') or []:
+                decode_tier_counts[tier] = decode_tier_counts.get(tier, 0) + 1
+
+class WorkerProcessDied(Exception):
+    """O processo filho terminou (OOM, segfault) com um segmento em andamento."""
+
+def worker_process_main(conn, worker_index):
+    """Laço do processo filho: carrega o modelo uma vez e transcreve os segmentos recebidos pelo Pipe."""
+    worker_state.index = worker_index
+    torch.set_num_threads(torch_threads_per_worker)
+    try:
+        load_model()
+    except Exception as e:
+        conn.send(('error', str(e)))
+        return
+    conn.send(('ready', None))
+    
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        try:
+            if job[0] == 'decode':
+                # Trecho avulso (refinamento de frases), com o modelo pedido
+                _, model_size, audio, options = job
+                result = load_model(model_size).transcribe(audio, options)
+            else:
+                _, segment, session_id = job
+                with segment_encoder_cache():
+                    result = transcribe_segment(segment, session_id)
+            conn.send(('result', result))
+        except Exception as e:
+            conn.send(('error', str(e)))
+
+def receive_from_worker_process(entry):
+    """Aguarda a próxima mensagem do processo filho, detectando se ele morreu."""
+    conn, process = entry['conn'], entry['process']
+    while True:
+        try:
+            if conn.poll(1.0):
+                return conn.recv()
+        except (EOFError, OSError):
+            break
+        if not process.is_alive():
+            # Uma última verificação: a resposta pode ter chegado antes do término
+            try:
+                if conn.poll(0):
+                    return conn.recv()
+            except (EOFError, OSError):
+                pass
+            break
+    process.join(timeout=5)
+    raise WorkerProcessDied(f"Processo {process.pid} terminou com código {process.exitcode}")
+
+def start_worker_process(worker_index):
+    """Inicia (ou reinicia) o processo filho do worker e espera o modelo ser carregado."""
+    previous = worker_processes.get(worker_index)
+    if previous:
+        previous['conn'].close()
+        if previous['process'].is_alive():
+            previous['process'].kill()
+        previous['process'].join(timeout=5)
+    
+    # spawn em vez de fork: o processo pai já tem threads do torch e do Flask em execução
+    context = multiprocessing.get_context('spawn')
+    parent_conn, child_conn = context.Pipe()
+    process = context.Process(target=worker_process_main, args=(child_conn, worker_index),
+                              name=f"transcription-process-{worker_index}", daemon=True)
+    process.start()
+    child_conn.close()
+    
+    entry = {'process': process, 'conn': parent_conn, 'restarts': previous['restarts'] + 1 if previous else 0}
+    worker_processes[worker_index] = entry
+    set_worker_stats(worker_index, pid=process.pid, restarts=entry['restarts'])
+    logger.info(f"Worker {worker_index}: processo {process.pid} iniciado, carregando modelo")
+    
+    kind, payload = receive_from_worker_process(entry)
+    if kind != 'ready':
+        raise RuntimeError(f"Processo do worker {worker_index} não carregou o modelo: {payload}")
+    return entry
+
+def worker_process_lock(worker_index):
+    with status_lock:
+        return worker_process_locks.setdefault(worker_index, threading.Lock())
+
+def call_worker_process(worker_index, job, description):
+    """Envia um pedido ao processo do worker e retorna o resultado; reinicia o processo se ele morrer."""
+    with worker_process_lock(worker_index):
+        entry = worker_processes.get(worker_index)
+        if entry is None or not entry['process'].is_alive():
+            entry = start_worker_process(worker_index)
+        
+        try:
+            entry['conn'].send(job)
+            kind, payload = receive_from_worker_process(entry)
+        except (WorkerProcessDied, BrokenPipeError, OSError) as e:
+            logger.error(f"Worker {worker_index}: processo morreu durante {description}: {str(e)}")
+            try:
+                start_worker_process(worker_index)
+            except Exception as restart_error:
+                # Nova tentativa de iniciar o processo no próximo pedido
+                logger.error(f"Worker {worker_index}: falha ao reiniciar o processo: {str(restart_error)}")
+            raise WorkerProcessDied(str(e))
+    
+    if kind == 'error':
+        raise RuntimeError(payload)
+    return payload
+
+def transcribe_in_worker_process(worker_index, segment, session_id):
+    """Envia o segmento ao processo do worker e retorna o resultado de transcribe_segment()."""
+    return call_worker_process(worker_index, ('segment', segment, session_id),
+                               f"o segmento {segment['index']} da sessão {session_id}")
+
+def decode_in_worker_process(worker_index, model_size, audio, options):
+    """Decodifica um trecho de áudio com `model_size` no processo do worker (refinamento no modo de processos)."""
+    return call_worker_process(worker_index, ('decode', model_size, audio, options), "o refinamento de uma frase")
 
-def worker_thread():
+@contextmanager
+def segment_encoder_cache():
+    """Mantém o cache do encoder durante o job de um segmento e o libera ao final."""
+    cache = EncoderCache(encoder_cache_max_bytes)
+    worker_state.encoder_cache = cache
+    try:
+        yield cache
+    finally:
+        worker_state.encoder_cache = None
+        if cache.hits:
+            logger.info(f"Cache do encoder: {cache.hits} janelas reaproveitadas, {cache.misses} codificadas")
+        cache.clear()
+
+def run_segment(worker_index, segment, session_id):
+    if execution_mode == 'process':
+        result = transcribe_in_worker_process(worker_index, segment, session_id)
+    else:
+        with segment_encoder_cache():
+            result = transcribe_segment(segment, session_id)
+    if isinstance(result, dict) and result.get('pending_postprocess'):
+        # O job só sai da fila persistida depois que o resultado for gravado na sessão
+        result['lease_id'] = processing_queue.detach()
+        submit_postprocess(result)
+    return result
+
+def submit_postprocess(job):
+    """Entrega a saída bruta do modelo ao estágio de pós-processamento (bloqueia se a fila estiver cheia)."""
+    job['queued_at'] = time.time()
+    start_postprocess_thread()
+    postprocess_queue.put(job)
+
+def postprocess_loop():
+    """Formata e grava os segmentos decodificados, em lotes.
+    
+    Espera o primeiro job e junta os que já estiverem na fila (até
+    POSTPROCESS_BATCH_SIZE); os resultados de uma mesma sessão são gravados
+    com uma única leitura e escrita do JSON. Sendo a única thread que grava
+    resultados, as contagens de segmentos da sessão não se perdem entre workers.
+    """
+    while True:
+        jobs = [postprocess_queue.get()]
+        while len(jobs) < postprocess_batch_size:
+            try:
+                jobs.append(postprocess_queue.get_nowait())
+            except QueueEmpty:
+                break
+        
+        started = time.time()
+        by_session = OrderedDict()
+        for job in jobs:
+            try:
+                formatted_result = format_segment_result(job)
+                by_session.setdefault(job['session_id'], []).append((job, formatted_result))
+            except Exception as e:
+                postprocess_stats['failed'] += 1
+                logger.error(f"Erro no pós-processamento do segmento {job['segment']['index']} "
+                             f"da sessão {job['session_id']}: {str(e)}")
+                # Registrar a falha na sessão antes de confirmar o job: refazer a decodificação daria o mesmo erro
+                try:
+                    record_segment_error(job['session_id'], job['segment']['index'], f"Pós-processamento: {str(e)}")
+                    release_job(job, retry=False)
+                except Exception as record_error:
+                    logger.error(f"Erro ao registrar a falha do segmento {job['segment']['index']}: {str(record_error)}")
+                    release_job(job, retry=True)
+        
+        for session_id, entries in by_session.items():
+            try:
+                save_segment_results(session_id, entries)
+                postprocess_stats['segments'] += len(entries)
+                postprocess_stats['phrases'] += sum(len(result['phrases']) for _, result in entries)
+                for job, _ in entries:
+                    release_job(job, retry=False)
+            except Exception as e:
+                postprocess_stats['failed'] += len(entries)
+                logger.error(f"Erro ao gravar {len(entries)} segmento(s) da sessão {session_id}: {str(e)}")
+                # Devolver à fila persistida: o segmento será decodificado de novo
+                for job, _ in entries:
+                    release_job(job, retry=True)
+        
+        finished = time.time()
+        postprocess_stats['batches'] += 1
+        postprocess_stats['busy_seconds'] += finished - started
+        postprocess_stats['wait_seconds'] += sum(started - job['queued_at'] for job in jobs)
+        logger.info(f"Pós-processamento: {len(jobs)} segmento(s) de {len(by_session)} sessão(ões) "
+                    f"em {finished - started:.3f}s")
+        for _ in jobs:
+            postprocess_queue.task_done()
+
+def release_job(job, retry):
+    """Confirma (retry=False) ou devolve à fila (retry=True) o job persistido de um resultado pós-processado."""
+    lease_id = job.get('lease_id')
+    if lease_id is None:
+        return
+    try:
+        if retry:
+            processing_queue.release(lease_id)
+        else:
+            processing_queue.ack(lease_id)
+    except Exception as e:
+        logger.error(f"Erro ao atualizar o job {lease_id} na fila persistida: {str(e)}")
+
+def start_postprocess_thread():
+    global postprocess_thread
+    with status_lock:
+        if postprocess_thread is None or not postprocess_thread.is_alive():
+            postprocess_thread = threading.Thread(target=postprocess_loop, name='postprocess', daemon=True)
+            postprocess_thread.start()
+
+def postprocess_metrics():
+    """Vazão e latência do estágio de pós-processamento, para o /health."""
+    stats = dict(postprocess_stats)
+    done = stats['segments'] + stats['failed']
+    return dict(
+        stats,
+        queue_size=postprocess_queue.qsize(),
+        alive=postprocess_thread is not None and postprocess_thread.is_alive(),
+        segments_per_second=round(stats['segments'] / stats['busy_seconds'], 2) if stats['busy_seconds'] else None,
+        avg_batch_size=round(done / stats['batches'], 2) if stats['batches'] else None,
+        avg_wait_seconds=round(stats['wait_seconds'] / done, 3) if done else None
+    )
+
+def requeue_crashed_segment(job, worker_index, error):
+    """Recoloca na fila o segmento que estava no processo que morreu, até max_retries vezes."""
+    segment, session_id = job
+    key = f"{session_id}_{segment['index']}"
+    with status_lock:
+        crashes = segment_crashes.get(key, 0) + 1
+        segment_crashes[key] = crashes
+    
+    if crashes > max_retries:
+        logger.error(f"Segmento {segment['index']} da sessão {session_id} derrubou o processo {crashes} vezes; desistindo")
+        count_segment_result(worker_index, failed=True)
+        record_abandoned_segment(session_id, segment['index'], f"Processo do worker terminou {crashes} vezes: {error}")
+        return
+    
+    logger.warning(f"Recolocando segmento {segment['index']} da sessão {session_id} na fila (queda {crashes})")
+    with status_lock:
+        segment_processing_status[key] = {'status': 'queued', 'requeued_at': time.time(), 'crashes': crashes}
+    # Devolver a concessão em vez de enfileirar de novo: o job continua com a posição original na fila
+    processing_queue.release()
+
+def record_abandoned_segment(session_id, segment_index, error):
+    """Marca como falho o segmento que não será mais tentado e registra o erro na sessão."""
+    with status_lock:
+        segment_processing_status[f"{session_id}_{segment_index}"] = {
+            'status': 'failed',
+            'end_time': time.time(),
+            'error': error
+        }
+    record_segment_error(session_id, segment_index, error)
+
+def resume_queued_jobs():
+    """Devolve à fila os segmentos que uma execução anterior do serviço deixou em andamento."""
+    try:
+        returned, pending = processing_queue.recover()
+    except Exception as e:
+        logger.error(f"Erro ao recuperar a fila persistida {job_queue_path}: {str(e)}")
+        return
+    if returned or pending:
+        logger.info(f"Fila persistida: {returned} segmento(s) interrompido(s) devolvido(s) à fila, "
+                    f"{pending} pendente(s) para retomar")
+
+def recover_interrupted_sessions():
+    """Retoma as sessões que ficaram em 'processing' ou 'transcribing' (por exemplo, após o processo ser morto).
+    
+    Apenas os segmentos ausentes da transcrição são reenfileirados, em ordem de
+    índice; os que já estão na fila persistida são ignorados pelo put(), e os
+    descartados pela fila ('dead') ou registrados em 'errors' não são refeitos.
+    """
+    recovered = 0
+    for filename in sorted(os.listdir(app.config['DATA_FOLDER'])):
+        if not filename.endswith('.json'):
+            continue
+        session_data = get_session_data(filename[:-len('.json')])
+        if not session_data or session_data.get('status') not in ('processing', 'transcribing'):
+            continue
+        session_id = session_data.get('session_id', filename[:-len('.json')])
+        segments = session_data.get('segments') or []
+        if not segments:
+            logger.warning(f"Recuperação: sessão {session_id} sem informações sobre segmentos")
+            continue
+        
+        found_segments = set(entry.get('segment_index') for entry in session_data.get('transcript') or [])
+        missing = sorted((s for s in segments if s['index'] not in found_segments), key=lambda s: s['index'])
+        if not missing:
+            if not session_data.get('segments_streaming'):
+                # Todos os segmentos gravados, mas o status não chegou a ser atualizado
+                check_session_completion(session_id)
+            continue
+        
+        # Segmentos que já falharam de vez: reenfileirá-los repetiria a falha (ou a queda) a cada reinício
+        given_up = processing_queue.dead_segments(session_id) | set(
+            error.get('segment_index') for error in session_data.get('errors') or [])
+        abandoned = [s['index'] for s in missing if s['index'] in given_up]
+        if abandoned:
+            logger.warning(f"Recuperação: sessão {session_id}: segmento(s) {abandoned} já falharam "
+                           f"(fila persistida ou erros da sessão); desistindo sem reenfileirar")
+            missing = [s for s in missing if s['index'] not in given_up]
+            if not missing:
+                continue
+        
+        queued = 0
+        for segment in missing:
+            if segment.get('path') and not os.path.exists(segment['path']):
+                logger.error(f"Recuperação: arquivo do segmento {segment['index']} da sessão {session_id} "
+                             f"não encontrado: {segment['path']}")
+                continue
+            if processing_queue.put((segment, session_id)):
+                queued += 1
+        logger.info(f"Recuperação: sessão {session_id} com {len(missing)} segmento(s) faltante(s) "
+                    f"{[s['index'] for s in missing]}; {queued} reenfileirado(s), os demais já estavam na fila")
+        if queued and not session_data.get('segments_streaming'):
+            start_periodic_check(session_id)
+        recovered += 1
+    
+    if recovered:
+        logger.info(f"Recuperação: {recovered} sessão(ões) interrompida(s) retomada(s)")
+
+def start_recovery_thread():
+    """Executa a recuperação uma vez por processo, em segundo plano: com a fila cheia, put() espera os workers."""
+    global recovery_thread
+    if not recover_sessions_on_startup:
+        return
+    with status_lock:
+        if recovery_thread is not None:
+            return
+        recovery_thread = threading.Thread(target=recover_sessions_safely, name='recovery', daemon=True)
+        recovery_thread.start()
+
+def recover_sessions_safely():
+    try:
+        recover_interrupted_sessions()
+    except Exception as e:
+        logger.error(f"Erro na recuperação das sessões interrompidas: {str(e)}")
+
+def preload_model():
+    """No modo de processos o modelo é carregado apenas nos processos filhos."""
+    if execution_mode == 'thread':
+        load_model()
+
+def worker_thread(worker_index=0):
     """Worker thread to process transcription jobs from the queue.
-    Implementação sequencial para processar áudios um após o outro.
+    Cada worker processa um segmento por vez com sua própria instância do modelo;
+    com TRANSCRIPTION_WORKERS=1 o processamento é sequencial.
     """
-    global segments_processed, segments_failed, segment_processing_status
+    global segment_processing_status
+    
+    worker_state.index = worker_index
+    # Em builds com OpenMP o número de threads vale por thread chamadora
+    torch.set_num_threads(torch_threads_per_worker)
+    set_worker_stats(worker_index, status='loading_model', session_id=None, segment_index=None)
+    try:
+        if execution_mode == 'process':
+            # A thread apenas despacha; o modelo vive no processo filho
+            with worker_process_lock(worker_index):
+                start_worker_process(worker_index)
+        else:
+            # O worker 0 reaproveita o cache global com o modelo pré-carregado; os demais têm o seu
+            worker_state.models = model_cache if worker_index == 0 else OrderedDict()
+            load_model()
+    except Exception as e:
+        logger.error(f"Worker {worker_index} não conseguiu carregar o modelo: {str(e)}")
+        set_worker_stats(worker_index, status='failed', error=str(e))
+        return
+    set_worker_stats(worker_index, status='idle')
+    logger.info(f"Worker {worker_index} pronto ({torch_threads_per_worker} threads do torch)")
     
     while True:
         # Inicializar job como None antes de tentar obter da fila
@@ -854,6 +1537,8 @@ def worker_thread():
             
             segment, session_id = job
             segment_index = segment['index']
+            set_worker_stats(worker_index, status='busy', session_id=session_id, segment_index=segment_index,
+                             started_at=time.time())
             
             # Registrar início do processamento no dicionário de status
             with status_lock:
@@ -863,15 +1548,15 @@ def worker_thread():
                     'attempts': 1
                 }
             
-            logger.info(f"Iniciando processamento sequencial do segmento {segment_index} da sessão {session_id}")
+            logger.info(f"Worker {worker_index} iniciando processamento do segmento {segment_index} da sessão {session_id}")
             start_time = time.time()
             
             # Tratamento especial para o segmento 0
             if segment_index == 0:
                 try:
                     logger.info(f"Processando segmento 0 da sessão {session_id} com tratamento especial")
-                    result = transcribe_segment(segment, session_id)
-                    segments_processed += 1
+                    result = run_segment(worker_index, segment, session_id)
+                    count_segment_result(worker_index, result=result)
                     
                     # Verificar se o resultado é válido
                     if isinstance(result, dict) and 'error' in result:
@@ -895,6 +1580,14 @@ def worker_thread():
                                     'end_time': time.time(),
                                     'error': 'Falha na transcrição forçada'
                                 }
+                    elif isinstance(result, dict) and result.get('pending_postprocess'):
+                        # Decodificado; o pós-processamento grava o segmento 0 na sessão mais tarde
+                        with status_lock:
+                            segment_processing_status[f"{session_id}_{segment_index}"] = {
+                                'status': 'completed',
+                                'end_time': time.time(),
+                                'processing_time': time.time() - start_time
+                            }
                     else:
                         # Verificar se o segmento 0 está na transcrição
                         session_data = get_session_data(session_id)
@@ -938,9 +1631,11 @@ def worker_thread():
                     processing_time = time.time() - start_time
                     logger.info(f"Segmento 0 processado em {processing_time:.2f} segundos")
                     
+                except WorkerProcessDied:
+                    raise
                 except Exception as e:
                     logger.error(f"Erro ao processar segmento 0: {str(e)}")
-                    segments_failed += 1
+                    count_segment_result(worker_index, failed=True)
                     with status_lock:
                         segment_processing_status[f"{session_id}_{segment_index}"] = {
                             'status': 'failed',
@@ -955,23 +1650,9 @@ def worker_thread():
                 
                 try:
                     # Processar o segmento
-                    result = transcribe_segment(segment, session_id)
-                    segments_processed += 1
-                    
-                    # Atualizar status da sessão com o progresso
-                    try:
-                        session_data = get_session_data(session_id)
-                        if session_data:
-                            total_segments = session_data.get('total_segments', 0)
-                            if total_segments > 0:
-                                update_session_status(
-                                    session_id, 
-                                    None,  # Manter o status atual
-                                    segments_processed=segments_processed,
-                                    progress=segments_processed / total_segments
-                                )
-                    except Exception as e2:
-                        logger.error(f"Erro ao atualizar progresso: {str(e2)}")
+                    result = run_segment(worker_index, segment, session_id)
+                    count_segment_result(worker_index, result=result)
+                    # Contadores e progresso da sessão são gravados pelo pós-processamento, junto com o resultado
                     
                     # Registrar tempo de processamento
                     processing_time = time.time() - start_time
@@ -980,11 +1661,16 @@ def worker_thread():
                     # Liberar memória explicitamente
                     if hasattr(torch, 'cuda') and torch.cuda.is_available():
                         torch.cuda.empty_cache()
+                except WorkerProcessDied:
+                    raise
                 except Exception as e:
                     logger.error(f"Erro ao processar segmento {segment['index']}: {str(e)}")
             
+        except WorkerProcessDied as e:
+            # O processo filho morreu com o segmento em andamento: recolocar na fila
+            requeue_crashed_segment(job, worker_index, str(e))
         except Exception as e:
-                segments_failed += 1
+                count_segment_result(worker_index, failed=True)
                 logger.error(f"Falha ao processar segmento {segment['index']}: {str(e)}")
                 
         except Exception as e:
@@ -993,6 +1679,7 @@ def worker_thread():
             # Marcar a tarefa como concluída apenas se realmente obtivemos um item da fila
             if job is not None:
                 processing_queue.task_done()
+                set_worker_stats(worker_index, status='idle', session_id=None, segment_index=None, started_at=None)
             
             # Log do progresso após cada segmento
             logger.info(f"Progresso da transcrição: {segments_processed} segmentos processados, {segments_failed} falhas")
@@ -1018,6 +1705,11 @@ def check_session_completion(session_id):
             logger.warning(f"Sessão {session_id} não tem informações sobre segmentos")
             return False
         
+        # Em modo pipeline a lista de segmentos ainda está incompleta até o /transcribe/finalize
+        if metadata.get('segments_streaming'):
+            logger.info(f"Sessão {session_id}: segmentos ainda chegando; conclusão verificada após o finalize")
+            return False
+        
         # Obter todos os índices de segmentos esperados
         expected_segments = set(segment['index'] for segment in metadata['segments'])
         total_segments = len(expected_segments)
@@ -1086,23 +1778,234 @@ def check_session_completion(session_id):
         return False
 
 def start_worker_threads():
-    """Start worker threads to process transcription jobs."""
+    """Start worker threads to process transcription jobs.
+    Garante max_workers threads vivas, substituindo as que tiverem terminado.
+    """
     global worker_threads
     
-    # Verificar se já existem threads em execução
-    if worker_threads:
-        logger.info(f"Worker threads já estão em execução: {len(worker_threads)} threads ativos")
+    with status_lock:
+        # Verificar se já existem threads em execução
+        if len(worker_threads) == max_workers and all(t.is_alive() for t in worker_threads):
+            logger.info(f"Worker threads já estão em execução: {len(worker_threads)} threads ativos")
+            return
+        
+        # Iniciar threads que ainda não existem ou que terminaram
+        started = 0
+        for i in range(max_workers):
+            if i < len(worker_threads) and worker_threads[i].is_alive():
+                continue
+            t = threading.Thread(target=worker_thread, args=(i,), name=f"transcription-worker-{i}")
+            t.daemon = True
+            t.start()
+            if i < len(worker_threads):
+                worker_threads[i] = t
+            else:
+                worker_threads.append(t)
+            started += 1
+    
+    logger.info(f"Starting {started} worker threads ({max_workers} configurados, {torch_threads_per_worker} threads do torch cada)")
+
+def queue_idle():
+    """Fila vazia, nenhum worker transcrevendo e nenhum resultado aguardando o pós-processamento."""
+    with status_lock:
+        busy = any(stats.get('status') == 'busy' for stats in worker_stats.values())
+    return processing_queue.empty() and not busy and postprocess_queue.unfinished_tasks == 0
+
+def needs_refinement(phrase):
+    """Frase ainda não refinada com baixa confiança ou texto repetitivo."""
+    if 'refined' in phrase or phrase.get('avg_logprob') is None:
+        return False
+    if phrase.get('text', '').strip() in ("", "[Trecho sem fala detectada]"):
+        return False
+    return (phrase['avg_logprob'] < refine_logprob_threshold
+            or (phrase.get('compression_ratio') or 0) > refine_compression_threshold)
+
+def find_refine_candidates(limit):
+    """As `limit` frases de menor confiança entre todas as sessões, como (session_id, segment_index, frase)."""
+    candidates = []
+    for filename in os.listdir(app.config['DATA_FOLDER']):
+        if not filename.endswith('.json'):
+            continue
+        session_data = get_session_data(filename[:-len('.json')])
+        if not session_data:
+            continue
+        for entry in session_data.get('transcript') or []:
+            if entry.get('quality_tier') == 'draft':
+                continue  # O segmento inteiro ainda será refeito pelo modelo final
+            for phrase in entry.get('phrases') or []:
+                if needs_refinement(phrase):
+                    candidates.append((session_data.get('session_id', filename[:-len('.json')]),
+                                       entry.get('segment_index'), phrase))
+    candidates.sort(key=lambda candidate: candidate[2]['avg_logprob'])
+    return candidates[:limit]
+
+def load_phrase_audio(session_data, segment_index, phrase):
+    """Trecho do WAV do segmento correspondente à frase (com uma pequena margem), ou None."""
+    segment = next((s for s in session_data.get('segments') or [] if s.get('index') == segment_index), None)
+    if segment is None or not os.path.exists(segment.get('path', '')):
+        return None
+    info, samples = load_pcm16(segment['path'])
+    if info['channels'] != 1 or info['sample_rate'] != 16000:
+        return None
+    start = max(0.0, phrase['start'] - segment['start_time'] - refine_padding_seconds)
+    end = phrase['end'] - segment['start_time'] + refine_padding_seconds
+    audio = samples[int(start * 16000):int(end * 16000)].astype(np.float32)
+    audio /= 32768.0
+    return audio if len(audio) else None
+
+def refine_phrase(session_id, segment_index, phrase):
+    """Redecodifica uma frase e a substitui no JSON da sessão se a confiança melhorar."""
+    session_data = get_session_data(session_id)
+    if not session_data:
         return
+    audio = load_phrase_audio(session_data, segment_index, phrase)
+    if audio is None:
+        outcome = {'refined': False}
+        refine_stats['phrases_failed'] += 1
+    else:
+        options = dict(get_retry_options(0), condition_on_previous_text=False)
+        if execution_mode == 'process':
+            # O modelo fica no processo filho do worker 0 (ocioso, já que a fila está vazia)
+            result = decode_in_worker_process(0, refine_model_name, audio, options)
+        else:
+            result = load_model(refine_model_name).transcribe(audio, options)
+        segments = [seg for seg in result.get('segments', []) if seg.get('text', '').strip()]
+        raw_text = ''.join(seg['text'] for seg in segments)
+        new_text = fix_repetitions(raw_text)
+        new_logprob = min((seg['avg_logprob'] for seg in segments if seg.get('avg_logprob') is not None), default=None)
+        if new_text.strip() and new_logprob is not None and new_logprob > phrase['avg_logprob']:
+            outcome = {
+                'refined': True,
+                'draft_text': phrase['text'],
+                'text': new_text,
+                'original_text': raw_text,
+                'corrected': new_text != raw_text,
+                'refine_model': refine_model_name,
+                'avg_logprob': new_logprob,
+                'no_speech_prob': max(seg.get('no_speech_prob') or 0.0 for seg in segments),
+                'compression_ratio': max(seg.get('compression_ratio') or 0.0 for seg in segments)
+            }
+            refine_stats['phrases_refined'] += 1
+            logger.info(f"Sessão {session_id}, segmento {segment_index}: frase em {phrase['start_formatted']} refinada "
+                        f"(logprob {phrase['avg_logprob']:.2f} -> {new_logprob:.2f})")
+        else:
+            # Não tentar de novo a mesma frase
+            outcome = {'refined': False}
+            refine_stats['phrases_kept'] += 1
     
-    # Iniciar threads
-    worker_threads = []
-    for i in range(max_workers):
-        t = threading.Thread(target=worker_thread)
-        t.daemon = True
-        t.start()
-        worker_threads.append(t)
+    def apply_outcome(metadata):
+        # Sobre o JSON lido com o bloqueio: o segmento pode ter sido retranscrito durante a decodificação
+        entry = next((e for e in metadata.get('transcript') or [] if e.get('segment_index') == segment_index), None)
+        if entry is None:
+            return
+        for current in entry.get('phrases') or []:
+            if current.get('start') == phrase['start'] and current.get('text') == phrase['text']:
+                current.update(outcome)
+                if outcome.get('refined'):
+                    old_text = phrase['text'].strip()
+                    if old_text and old_text in entry['text']:
+                        entry['text'] = entry['text'].replace(old_text, outcome['text'].strip(), 1)
+                    else:
+                        entry['text'] = ''.join(p['text'] for p in entry['phrases'])
+                return
     
-    logger.info(f"Starting {len(worker_threads)} worker threads")
+    update_session_status(session_id, None, update=apply_outcome)
+
+def refine_loop():
+    """Thread de baixa prioridade: só decodifica enquanto não há segmentos na fila."""
+    # Instância própria do modelo, para não disputar a dos workers (no modo de processos, decodifica no filho)
+    worker_state.models = OrderedDict()
+    torch.set_num_threads(torch_threads_per_worker)
+    while True:
+        time.sleep(refine_idle_seconds)
+        if not queue_idle():
+            continue
+        try:
+            candidates = find_refine_candidates(refine_max_phrases)
+        except Exception as e:
+            logger.error(f"Erro ao procurar frases para refinar: {str(e)}")
+            continue
+        for session_id, segment_index, phrase in candidates:
+            if not queue_idle():
+                break  # Segmentos novos têm prioridade
+            try:
+                refine_phrase(session_id, segment_index, phrase)
+            except Exception as e:
+                refine_stats['phrases_failed'] += 1
+                logger.error(f"Erro ao refinar frase da sessão {session_id}, segmento {segment_index}: {str(e)}")
+
+def start_refine_thread():
+    global refine_thread
+    if refine_enabled and (refine_thread is None or not refine_thread.is_alive()):
+        refine_thread = threading.Thread(target=refine_loop, name='refine', daemon=True)
+        refine_thread.start()
+        logger.info(f"Refinamento em segundo plano ativo (modelo {refine_model_name}, "
+                    f"logprob < {refine_logprob_threshold})")
+
+def summarize_quality_tiers(session_data):
+    """Contagem dos segmentos da transcrição por nível de qualidade."""
+    tiers = {'draft': 0, 'final': 0}
+    for entry in session_data.get('transcript') or []:
+        tier = entry.get('quality_tier', 'final')
+        tiers[tier] = tiers.get(tier, 0) + 1
+    return tiers
+
+def find_draft_segments(limit):
+    """Segmentos ainda em rascunho, das sessões mais antigas para as mais novas."""
+    drafts = []
+    # Só os JSON das sessões: .lock, .tmp e os arquivos -wal/-shm da fila aparecem e somem o tempo todo
+    session_files = []
+    for filename in os.listdir(app.config['DATA_FOLDER']):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            session_files.append((os.path.getmtime(os.path.join(app.config['DATA_FOLDER'], filename)), filename))
+        except FileNotFoundError:
+            continue  # Sessão removida durante a varredura
+    for _, filename in sorted(session_files):
+        session_data = get_session_data(filename[:-len('.json')])
+        if not session_data:
+            continue
+        session_id = session_data.get('session_id', filename[:-len('.json')])
+        segments = {s.get('index'): s for s in session_data.get('segments') or []}
+        for entry in session_data.get('transcript') or []:
+            index = entry.get('segment_index')
+            if entry.get('quality_tier') != 'draft' or index not in segments:
+                continue
+            if upgrade_attempts.get(f"{session_id}_{index}", 0) >= max_retries:
+                continue
+            drafts.append((dict(segments[index], quality_tier='final'), session_id))
+            if len(drafts) >= limit:
+                return drafts
+    return drafts
+
+def upgrade_loop():
+    """Envia os segmentos em rascunho para a versão final quando a fila fica ociosa.
+    
+    Os rascunhos de sessões novas continuam passando na frente: no máximo um
+    segmento por worker é enviado, e só com a fila vazia e todos os workers livres.
+    """
+    while True:
+        time.sleep(upgrade_poll_seconds)
+        if not queue_idle():
+            continue
+        try:
+            jobs = find_draft_segments(max_workers)
+        except Exception as e:
+            logger.error(f"Erro ao procurar segmentos em rascunho: {str(e)}")
+            continue
+        for segment, session_id in jobs:
+            key = f"{session_id}_{segment['index']}"
+            upgrade_attempts[key] = upgrade_attempts.get(key, 0) + 1
+            logger.info(f"Segmento {segment['index']} da sessão {session_id}: gerando versão final com {model_name}")
+            processing_queue.put((segment, session_id))
+
+def start_upgrade_thread():
+    global upgrade_thread
+    if pipeline_mode == 'draft' and (upgrade_thread is None or not upgrade_thread.is_alive()):
+        upgrade_thread = threading.Thread(target=upgrade_loop, name='upgrade', daemon=True)
+        upgrade_thread.start()
+        logger.info(f"Pipeline em duas passadas: rascunho com {draft_model_name}, versão final com {model_name}")
 
 @app.route('/transcribe', methods=['POST'])
 def transcribe_audio():
@@ -1137,11 +2040,12 @@ def transcribe_audio():
         segments_processed=0,
         segments_completed=0,
         progress=0.0,
-        segments=segments  # Salvar informações completas sobre os segmentos
+        segments=segments,  # Salvar informações completas sobre os segmentos
+        transcription_settings=get_transcription_settings()
     )
     
     # Ensure model is loaded
-    load_model()
+    preload_model()
     
     # Start worker threads if not already started
     start_worker_threads()
@@ -1187,6 +2091,18 @@ def transcribe_audio():
                 processing_queue.put((segment, session_id))
     
     # Adicionar uma verificação periódica da integridade da sessão
+    start_periodic_check(session_id)
+    
+    return jsonify({
+        'status': 'success',
+        'message': f'Transcription jobs queued for {processing_mode()} processing',
+        'session_id': session_id,
+        'segments_queued': len(segments),
+        'processing_mode': processing_mode()
+    })
+
+def start_periodic_check(session_id):
+    """Inicia uma thread que verifica periodicamente a conclusão da sessão."""
     def periodic_check():
         # Verificar a cada minuto se todos os segmentos foram processados
         for _ in range(30):  # Verificar por até 30 minutos
@@ -1200,16 +2116,140 @@ def transcribe_audio():
     check_thread = threading.Thread(target=periodic_check)
     check_thread.daemon = True
     check_thread.start()
+
+@app.route('/transcribe/segment', methods=['POST'])
+def transcribe_single_segment():
+    """Endpoint para enfileirar um único segmento assim que ele é gerado.
+    
+    Usado pelo pré-processamento em modo pipeline: o total de segmentos só é
+    conhecido quando /transcribe/finalize é chamado, então a sessão não é
+    marcada como concluída antes disso.
+    """
+    data = request.json
+    if not data or 'session_id' not in data or 'segment' not in data:
+        return jsonify({'error': 'Missing required parameters'}), 400
+    
+    session_id = data['session_id']
+    segment = data['segment']
+    
+    # Registrar o segmento nos metadados da sessão
+    session_data = get_session_data(session_id) or {}
+    if segment['index'] == 0:
+        # Primeiro segmento: reiniciar contadores e status desta sessão
+        segments = [segment]
+        with status_lock:
+            for key in list(segment_processing_status.keys()):
+                if key.startswith(f"{session_id}_"):
+                    del segment_processing_status[key]
+        
+        def reset_previous_run(metadata):
+            # Resultados e totais de uma execução anterior da mesma sessão não valem para esta
+            for key in ('transcript', 'total_segments', 'missing_segments', 'missing_phrases_segments',
+                        'all_segments_have_phrases', 'errors', 'completion_time'):
+                metadata.pop(key, None)
+        
+        update_session_status(
+            session_id,
+            'processing',
+            update=reset_previous_run,
+            segments_processed=0,
+            segments_completed=0,
+            progress=0.0,
+            segments=segments,
+            segments_streaming=True,
+            transcription_settings=get_transcription_settings()
+        )
+    else:
+        segments = [s for s in session_data.get('segments', []) if s['index'] != segment['index']]
+        segments.append(segment)
+        segments.sort(key=lambda x: x['index'])
+        update_session_status(session_id, 'processing', segments=segments)
+    
+    # Ensure model is loaded
+    preload_model()
+    
+    # Start worker threads if not already started
+    start_worker_threads()
+    
+    logger.info(f"Adicionando segmento {segment['index']} da sessão {session_id} à fila (pipeline)")
+    try:
+        processing_queue.put((segment, session_id), timeout=60)
+    except Exception as e:
+        logger.error(f"Erro ao adicionar segmento {segment['index']} à fila: {str(e)}")
+        time.sleep(5)
+        processing_queue.put((segment, session_id))
     
     return jsonify({
         'status': 'success',
-        'message': 'Transcription jobs queued for sequential processing',
         'session_id': session_id,
-        'segments_queued': len(segments),
-        'processing_mode': 'sequential'
+        'segment_index': segment['index'],
+        'queue_size': processing_queue.qsize()
+    })
+
+@app.route('/transcribe/finalize', methods=['POST'])
+def finalize_transcription():
+    """Endpoint chamado quando o pré-processamento termina de gerar segmentos."""
+    data = request.json
+    if not data or 'session_id' not in data or 'total_segments' not in data:
+        return jsonify({'error': 'Missing required parameters'}), 400
+    
+    session_id = data['session_id']
+    update_kwargs = {
+        'total_segments': data['total_segments'],
+        'segments_streaming': False
+    }
+    if data.get('segments'):
+        update_kwargs['segments'] = data['segments']
+    if data.get('preprocessing_completed'):
+        update_kwargs['preprocessing_completed'] = data['preprocessing_completed']
+    
+    def close_stream(metadata):
+        # A conclusão é decidida por save_segment_results quando chega o último resultado;
+        # aqui só se todos os resultados já tiverem chegado antes de o total ser conhecido
+        fields = dict(update_kwargs)
+        merged = dict(metadata, **fields)
+        transcript = merged.get('transcript') or []
+        total_segments = merged['total_segments']
+        if (total_segments > 0 and merged.get('segments_completed', 0) >= total_segments
+                and all(entry.get('phrases') for entry in transcript)):
+            fields.update(status='completed', completion_time=datetime.now().isoformat(), all_segments_have_phrases=True)
+        else:
+            fields.update(settle_failed_segments(merged))
+        return fields
+    
+    update_session_status(session_id, None, update=close_stream)
+    
+    return jsonify({
+        'status': 'success',
+        'session_id': session_id,
+        'total_segments': data['total_segments']
     })
 
 
+def get_transcription_settings():
+    """Configurações que determinam o resultado da transcrição.
+    
+    Gravadas em cada sessão para que o pré-processamento só reaproveite
+    transcrições de áudios idênticos feitas com as mesmas configurações.
+    """
+    return {
+        'model': model_name,
+        'engine': engine_name,
+        'ct2_compute_type': ct2_compute_type if engine_name == 'ctranslate2' else None,
+        'quantize': whisper_quantize if engine_name == 'whisper' else None,
+        'vad_enabled': vad_enabled,
+        'vad_threshold_db': vad_threshold_db,
+        'batched_decoding': batched_decoding,
+        'adaptive_policy': adaptive_policy if batched_decoding else None,
+        'pipeline_mode': pipeline_mode,
+        'draft_model': draft_model_name if pipeline_mode == 'draft' else None
+    }
+
+@app.route('/settings', methods=['GET'])
+def get_settings():
+    """Retorna as configurações de transcrição em uso."""
+    return jsonify(get_transcription_settings())
+
 @app.route('/status/<session_id>', methods=['GET'])
 def get_transcription_status(session_id):
     """Get the status of a transcription session."""
@@ -1223,7 +2263,8 @@ def get_transcription_status(session_id):
         'segments_total': session_data.get('segments_total', 0),
         'segments_completed': session_data.get('segments_completed', 0),
         'progress': session_data.get('progress', 0),
-        'errors': session_data.get('errors', [])
+        'errors': session_data.get('errors', []),
+        'quality_tiers': summarize_quality_tiers(session_data)
     })
 
 def force_transcribe_segment0_internal(session_id):
@@ -1312,7 +2353,9 @@ def force_transcribe_segment0_internal(session_id):
         if not segment_exists:
             segments_completed += 1
         
-        segments_total = len(session_data['segments'])
+        # Com os segmentos ainda chegando (modo pipeline), a lista parcial não é o total
+        segments_total = session_data.get('total_segments') or len(session_data['segments'])
+        streaming = session_data.get('segments_streaming', False)
         progress = segments_completed / segments_total if segments_total > 0 else 0
         
         # Atualizar status da sessão
@@ -1324,7 +2367,7 @@ def force_transcribe_segment0_internal(session_id):
         }
         
         # Se todos os segmentos foram processados, marcar como concluído
-        if segments_completed >= segments_total:
+        if segments_completed >= segments_total and not streaming:
             update_kwargs['completion_time'] = datetime.now().isoformat()
             update_session_status(session_id, 'completed', **update_kwargs)
         else:
@@ -1363,7 +2406,6 @@ def force_transcribe_segment0(session_id):
     else:
         return jsonify({"error": f"Falha ao forçar transcrição do segmento 0 para a sessão {session_id}"}), 500
 
-@app.route('/health', methods=['GET'])
 def check_and_reprocess_missing_segments(session_id):
     """Verifica se há segmentos faltantes na transcrição e os reprocessa.
     Esta função é útil para recuperar sessões com segmentos perdidos.
@@ -1451,12 +2493,20 @@ def reprocess_missing_segments(session_id):
     """Endpoint para reprocessar segmentos faltantes de uma sessão."""
     return check_and_reprocess_missing_segments(session_id)
 
+@app.route('/health', methods=['GET'])
 def health_check():
     # Verificar status dos worker threads
     active_workers = len([t for t in worker_threads if t.is_alive()])
+    with status_lock:
+        workers_detail = [
+            dict(worker_stats.get(i, {}), index=i, alive=t.is_alive())
+            for i, t in enumerate(worker_threads)
+        ]
+    busy_workers = len([w for w in workers_detail if w.get('status') == 'busy'])
     
     # Calcular estatísticas
     queue_size = processing_queue.qsize()
+    queue_counts = processing_queue.counts()
     queue_utilization = (queue_size / processing_queue.maxsize) * 100 if processing_queue.maxsize > 0 else 0
     
     # Verificar uso de memória
@@ -1486,37 +2536,64 @@ def health_check():
         'status': 'healthy', 
         'service': 'transcription',
         'model': model_name,
+        'engine': engine_name,
         'workers': {
             'configured': max_workers,
-            'active': active_workers
+            'active': active_workers,
+            'busy': busy_workers,
+            'torch_threads_per_worker': torch_threads_per_worker,
+            'execution_mode': execution_mode,
+            'details': workers_detail
         },
         'queue': {
             'size': queue_size,
             'max_size': processing_queue.maxsize,
+            'path': job_queue_path,
+            'jobs_by_status': queue_counts,
             'utilization_percent': f"{queue_utilization:.1f}%"
         },
         'stats': {
             'segments_processed': segments_processed,
-            'segments_failed': segments_failed
+            'segments_failed': segments_failed,
+            'decode_tiers': dict(decode_tier_counts)
+        },
+        'pipeline': {
+            'mode': pipeline_mode,
+            'draft_model': draft_model_name if pipeline_mode == 'draft' else None,
+            'upgrade_alive': upgrade_thread is not None and upgrade_thread.is_alive()
         },
+        'postprocess': postprocess_metrics(),
+        'refine': dict(refine_stats, enabled=refine_enabled, model=refine_model_name,
+                       alive=refine_thread is not None and refine_thread.is_alive()),
         'sessions': processing_sessions,
         'memory': memory_info,
         'timestamp': datetime.now().isoformat(),
-        'processing_mode': 'sequential'
+        'processing_mode': processing_mode()
     })
 
 # Initialize the app
 @app.before_first_request
 def initialize():
     # Pre-load the model
-    load_model()
+    preload_model()
+    # Retomar os segmentos da fila persistida antes de iniciar os workers
+    resume_queued_jobs()
     # Start worker threads
     start_worker_threads()
+    start_recovery_thread()
+    start_refine_thread()
+    start_upgrade_thread()
 
 if __name__ == '__main__':
     # Pre-load the model
-    load_model()
+    preload_model()
+    # Retomar os segmentos da fila persistida antes de iniciar os workers
+    resume_queued_jobs()
     # Start worker threads
     start_worker_threads()
+    start_recovery_thread()
+    start_refine_thread()
+    start_upgrade_thread()
     # Run the Flask app
-    app.run(host='0.0.0.0', port=8002, debug=True)
\ No newline at end of file
+    # Sem o reloader: ele executaria este bloco num segundo processo, com outros workers consumindo a mesma fila
+    app.run(host='0.0.0.0', port=8002, debug=True, use_reloader=False)
\ No newline at end of file
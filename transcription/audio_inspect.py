@@ -0,0 +1,224 @@
+"""Inspeção de arquivos WAV sem subprocessos.
+
+Lê o cabeçalho RIFF diretamente e calcula RMS/pico em uma única passada
+sobre o arquivo mapeado em memória. Os segmentos gerados pelo pré-processamento
+são sempre PCM 16-bit mono a 16 kHz, mas os formatos PCM inteiros de 8/16/32 bits
+e float de 32 bits também são aceitos. Também fornece a energia por quadro
+usada para localizar pausas na fala.
+"""
+import mmap
+import struct
+
+import numpy as np
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Amostras processadas por bloco no cálculo das estatísticas
+STATS_CHUNK_SAMPLES = 1 << 20
+
+
+def _sample_dtype(format_tag, bits_per_sample):
+    """Retorna o dtype NumPy e o fator de escala para o formato informado."""
+    if format_tag == WAVE_FORMAT_PCM:
+        if bits_per_sample == 8:
+            return np.dtype('u1'), 128.0
+        if bits_per_sample == 16:
+            return np.dtype('<i2'), 32768.0
+        if bits_per_sample == 32:
+            return np.dtype('<i4'), 2147483648.0
+    elif format_tag == WAVE_FORMAT_IEEE_FLOAT and bits_per_sample == 32:
+        return np.dtype('<f4'), 1.0
+    raise ValueError(f"Formato WAV não suportado: format_tag={format_tag}, bits={bits_per_sample}")
+
+
+def read_wav_header(mm):
+    """Percorre os chunks RIFF e retorna os campos do 'fmt ' e a posição do 'data'."""
+    if len(mm) < 12 or mm[0:4] != b'RIFF' or mm[8:12] != b'WAVE':
+        raise ValueError("Arquivo não é um WAV RIFF válido")
+
+    fmt = None
+    offset = 12
+    while offset + 8 <= len(mm):
+        chunk_id = mm[offset:offset + 4]
+        chunk_size = struct.unpack_from('<I', mm, offset + 4)[0]
+        body = offset + 8
+
+        if chunk_id == b'fmt ':
+            format_tag, channels, sample_rate, _byte_rate, block_align, bits_per_sample = \
+                struct.unpack_from('<HHIIHH', mm, body)
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 40:
+                # Os dois primeiros bytes do SubFormat GUID trazem o formato real
+                format_tag = struct.unpack_from('<H', mm, body + 24)[0]
+            fmt = {
+                'format_tag': format_tag,
+                'channels': channels,
+                'sample_rate': sample_rate,
+                'block_align': block_align,
+                'bits_per_sample': bits_per_sample
+            }
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise ValueError("Chunk 'data' encontrado antes do chunk 'fmt '")
+            # FFmpeg escrevendo em fluxo pode deixar o tamanho zerado ou em 0xFFFFFFFF
+            available = len(mm) - body
+            if chunk_size == 0 or chunk_size > available:
+                chunk_size = available
+            fmt['data_offset'] = body
+            fmt['data_size'] = chunk_size
+            return fmt
+
+        # Chunks têm tamanho par (byte de preenchimento)
+        offset = body + chunk_size + (chunk_size & 1)
+
+    raise ValueError("Chunk 'data' não encontrado no arquivo WAV")
+
+
+def inspect_wav(path, compute_stats=True):
+    """Retorna duração, taxa de amostragem, canais e estatísticas de nível de um WAV.
+
+    A duração vem do número de quadros no chunk 'data' (precisão de microssegundos).
+    RMS e pico são normalizados para a faixa [0, 1] e calculados em uma única
+    passada sobre o arquivo mapeado em memória, sem decodificar via FFmpeg.
+    """
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            header = read_wav_header(mm)
+
+            block_align = header['block_align'] or 1
+            num_frames = header['data_size'] // block_align
+            sample_rate = header['sample_rate']
+            info = {
+                'sample_rate': sample_rate,
+                'channels': header['channels'],
+                'bits_per_sample': header['bits_per_sample'],
+                'num_frames': num_frames,
+                'duration': round(num_frames / sample_rate, 6) if sample_rate else 0.0,
+                'data_offset': header['data_offset'],
+                'data_size': num_frames * block_align
+            }
+
+            if compute_stats:
+                dtype, scale = _sample_dtype(header['format_tag'], header['bits_per_sample'])
+                total = num_frames * header['channels']
+                samples = np.frombuffer(mm, dtype=dtype, count=total, offset=header['data_offset'])
+
+                sum_squares = 0.0
+                peak = 0.0
+                for start in range(0, total, STATS_CHUNK_SAMPLES):
+                    chunk = samples[start:start + STATS_CHUNK_SAMPLES].astype(np.float32)
+                    if dtype.kind == 'u':
+                        chunk -= scale
+                    sum_squares += float(np.dot(chunk, chunk))
+                    peak = max(peak, float(chunk.max()), float(-chunk.min()))
+                # Liberar a view antes de fechar o mmap
+                del samples
+
+                info['rms'] = (sum_squares / total) ** 0.5 / scale if total else 0.0
+                info['peak'] = peak / scale if total else 0.0
+
+            return info
+
+
+def load_pcm16(path):
+    """Retorna (info, amostras) com um numpy.memmap sobre o chunk 'data' de um WAV PCM 16-bit.
+
+    Nenhuma amostra é copiada: a leitura acontece sob demanda pelo mapeamento.
+    """
+    info = inspect_wav(path, compute_stats=False)
+    if info['bits_per_sample'] != 16:
+        raise ValueError(f"Esperado PCM 16-bit, encontrado {info['bits_per_sample']} bits")
+    total = info['num_frames'] * info['channels']
+    if total == 0:
+        return info, np.zeros(0, dtype='<i2')
+    samples = np.memmap(path, dtype='<i2', mode='r', offset=info['data_offset'], shape=(total,))
+    return info, samples
+
+
+def frame_energy_db(samples, frame_size, full_scale=32768.0):
+    """Energia (dBFS) de cada quadro de `frame_size` amostras.
+
+    `full_scale` é o valor de fundo de escala: 32768 para PCM 16-bit, 1.0 para float.
+    """
+    num_frames = len(samples) // frame_size
+    if num_frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = np.asarray(samples[:num_frames * frame_size]).reshape(num_frames, frame_size).astype(np.float32)
+    frames /= full_scale
+    mean_square = np.einsum('ij,ij->i', frames, frames) / frame_size
+    return 10.0 * np.log10(mean_square + 1e-10)
+
+
+def find_quiet_point(samples, sample_rate, target, window, frame_ms=20, smooth_ms=300, full_scale=32768.0):
+    """Encontra o ponto mais silencioso em [target - window, target + window].
+
+    `target` e `window` são dados em segundos; o retorno é o índice da amostra
+    no centro do trecho de menor energia média (suavizada em `smooth_ms`).
+    """
+    frame_size = int(sample_rate * frame_ms / 1000)
+    start = max(0, int((target - window) * sample_rate))
+    end = min(len(samples), int((target + window) * sample_rate))
+    energy = frame_energy_db(samples[start:end], frame_size, full_scale)
+    if len(energy) == 0:
+        return min(int(target * sample_rate), len(samples))
+
+    # Média móvel para preferir pausas reais a quadros isolados
+    smooth_frames = max(1, smooth_ms // frame_ms)
+    if len(energy) > smooth_frames:
+        kernel = np.ones(smooth_frames, dtype=np.float32) / smooth_frames
+        energy = np.convolve(energy, kernel, mode='same')
+
+    quietest = int(np.argmin(energy))
+    return start + quietest * frame_size + frame_size // 2
+
+
+def speech_regions(samples, sample_rate, frame_ms=30, threshold_db=None, min_speech_ms=250,
+                   min_silence_ms=1000, padding_ms=300):
+    """Detecta trechos com fala por energia e retorna [(início, fim)] em índices de amostra.
+
+    Sem `threshold_db`, o limiar acompanha o ruído de fundo do próprio trecho
+    (percentil 10 da energia + 10 dB), limitado a [-60, -40] dBFS para que
+    um segmento inteiro de fala não seja descartado. Pausas menores que
+    `min_silence_ms` são absorvidas e cada trecho ganha `padding_ms` de margem.
+    """
+    frame_size = int(sample_rate * frame_ms / 1000)
+    energy = frame_energy_db(samples, frame_size)
+    if len(energy) == 0:
+        return []
+
+    if threshold_db is None:
+        threshold_db = float(np.clip(np.percentile(energy, 10) + 10.0, -60.0, -40.0))
+    voiced = energy > threshold_db
+
+    # Bordas de subida/descida da máscara de quadros com fala
+    edges = np.diff(np.concatenate(([0], voiced.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    min_silence_frames = max(1, min_silence_ms // frame_ms)
+    min_speech_frames = max(1, min_speech_ms // frame_ms)
+    padding_frames = padding_ms // frame_ms
+
+    merged = []
+    for start, end in zip(starts, ends):
+        if merged and start - merged[-1][1] < min_silence_frames:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+
+    regions = []
+    for start, end in merged:
+        if end - start < min_speech_frames:
+            continue
+        start = int(max(0, start - padding_frames)) * frame_size
+        end = int(min(len(energy), end + padding_frames)) * frame_size
+        if regions and start <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], end)
+        else:
+            regions.append((start, end))
+
+    # O último quadro parcial pertence ao trecho final, se houver
+    if regions and regions[-1][1] == len(energy) * frame_size:
+        regions[-1] = (regions[-1][0], len(samples))
+    return regions
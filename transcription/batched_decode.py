@@ -0,0 +1,369 @@
+"""Transcrição em lote por janelas de 30 s.
+
+O `transcribe()` do Whisper avança janela por janela, rodando o encoder uma
+vez para cada mel de 30 s. Aqui o áudio é dividido em janelas de até 30 s
+(cortadas em pausas), os mels são empilhados e o encoder roda em lotes; a
+decodificação (com o mesmo fallback de temperatura do Whisper) e a montagem
+dos trechos com timestamps acontecem depois, janela por janela.
+
+Com uma política adaptativa (`policy`), cada janela é decodificada primeiro de
+forma gulosa; só as janelas com baixa confiança, texto repetitivo ou dúvida
+entre fala e silêncio sobem para a busca em feixe das opções pedidas. O nível
+usado em cada janela ('greedy' ou 'beam') fica registrado nos trechos.
+
+O resultado tem o mesmo formato do `transcribe()`: {'text', 'segments', 'language'}.
+"""
+import hashlib
+import logging
+from collections import OrderedDict
+
+import torch
+import whisper
+from whisper.audio import N_SAMPLES, SAMPLE_RATE
+from whisper.tokenizer import get_tokenizer
+
+from audio_inspect import find_quiet_point
+
+logger = logging.getLogger(__name__)
+
+WINDOW_SECONDS = N_SAMPLES / SAMPLE_RATE
+# Duração de cada token de timestamp do Whisper
+TIME_PRECISION = 0.02
+# Trecho final de cada janela em que se procura uma pausa para o corte
+CUT_SEARCH_SECONDS = 4.0
+
+
+def split_windows(audio, sample_rate=SAMPLE_RATE):
+    """Divide o áudio em janelas de até 30 s, cortando no ponto mais silencioso do final de cada uma.
+
+    Retorna [(início, fim)] em índices de amostra.
+    """
+    windows = []
+    start = 0
+    max_len = int(WINDOW_SECONDS * sample_rate)
+    while start < len(audio):
+        if len(audio) - start <= max_len:
+            windows.append((start, len(audio)))
+            break
+        half = CUT_SEARCH_SECONDS / 2
+        target = start / sample_rate + WINDOW_SECONDS - half
+        cut = find_quiet_point(audio, sample_rate, target, half, full_scale=1.0)
+        cut = min(max(cut, start + 1), start + max_len)
+        windows.append((start, cut))
+        start = cut
+    return windows
+
+
+class EncoderCache:
+    """Features do encoder por janela, válidas durante um job de segmento.
+
+    As tentativas de um mesmo segmento mudam apenas as opções de decodificação;
+    com o cache, só a primeira paga o encoder. A chave é o modelo e o conteúdo
+    da janela, então um áudio recodificado entre tentativas não reaproveita
+    features antigas. Ao passar de `max_bytes`, as entradas mais antigas saem.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model, window, dtype):
+        return id(model), str(dtype), len(window), hashlib.blake2b(window.tobytes(), digest_size=16).digest()
+
+    def get(self, key):
+        features = self.entries.get(key)
+        if features is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return features
+
+    def put(self, key, features):
+        size = features.numel() * features.element_size()
+        if size > self.max_bytes:
+            return
+        while self.entries and self.bytes + size > self.max_bytes:
+            _old_key, old = self.entries.popitem(last=False)
+            self.bytes -= old.numel() * old.element_size()
+        self.entries[key] = features
+        self.bytes += size
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+
+def encode_windows(model, windows, batch_size=8, fp16=False, cache=None):
+    """Roda o encoder sobre os mels das janelas em lotes de `batch_size`.
+
+    `windows` é uma lista de arrays float32 com até 30 s cada. Retorna um tensor
+    (janelas, n_audio_ctx, n_audio_state) com as features de áudio. Com `cache`,
+    apenas as janelas ainda não codificadas passam pelo encoder.
+    """
+    dtype = torch.float16 if fp16 and model.device.type == 'cuda' else torch.float32
+    features = [None] * len(windows)
+    keys = [None] * len(windows)
+    pending = []
+    for index, window in enumerate(windows):
+        if cache is not None:
+            keys[index] = EncoderCache.key(model, window, dtype)
+            features[index] = cache.get(keys[index])
+        if features[index] is None:
+            pending.append(index)
+
+    with torch.inference_mode():
+        for first in range(0, len(pending), batch_size):
+            indices = pending[first:first + batch_size]
+            batch = [
+                whisper.log_mel_spectrogram(whisper.pad_or_trim(windows[index]), model.dims.n_mels)
+                for index in indices
+            ]
+            mel = torch.stack(batch).to(model.device, dtype=dtype)
+            for index, window_features in zip(indices, model.embed_audio(mel)):
+                features[index] = window_features
+                if cache is not None:
+                    cache.put(keys[index], window_features)
+    return torch.stack(features)
+
+
+def decode_with_fallback(model, audio_features, options, prompt):
+    """Decodifica uma janela já codificada, subindo a temperatura como o transcribe() do Whisper."""
+    temperatures = options.get('temperature', 0.0)
+    if not isinstance(temperatures, (list, tuple)):
+        temperatures = [temperatures]
+    compression_threshold = options.get('compression_ratio_threshold', 2.4)
+    logprob_threshold = options.get('logprob_threshold', -1.0)
+    no_speech_threshold = options.get('no_speech_threshold', 0.6)
+
+    result = None
+    for temperature in temperatures:
+        decode_options = whisper.DecodingOptions(
+            task=options.get('task', 'transcribe'),
+            language=options.get('language'),
+            temperature=temperature,
+            # Busca em feixe só em temperatura zero; amostragem usa best_of
+            beam_size=options.get('beam_size') if temperature == 0 else None,
+            best_of=options.get('best_of') if temperature > 0 else None,
+            prompt=prompt,
+            suppress_blank=options.get('suppress_blank', True),
+            fp16=options.get('fp16', False)
+        )
+        with torch.inference_mode():
+            result = whisper.decode(model, audio_features, decode_options)
+
+        needs_fallback = False
+        if compression_threshold is not None and result.compression_ratio > compression_threshold:
+            needs_fallback = True  # Provavelmente repetitivo
+        if logprob_threshold is not None and result.avg_logprob < logprob_threshold:
+            needs_fallback = True  # Pouca confiança
+        if no_speech_threshold is not None and result.no_speech_prob > no_speech_threshold:
+            needs_fallback = False  # Silêncio: não adianta subir a temperatura
+        if not needs_fallback:
+            break
+    return result
+
+
+def options_tier(options):
+    """Nível de custo das opções: 'greedy' (um caminho, temperatura única) ou 'beam'."""
+    temperatures = options.get('temperature', 0.0)
+    single_temperature = not isinstance(temperatures, (list, tuple)) or len(temperatures) <= 1
+    return 'greedy' if (options.get('beam_size') or 1) <= 1 and single_temperature else 'beam'
+
+
+def is_silent(decoded, options):
+    """Janela sem fala: mesmo critério do transcribe() do Whisper."""
+    no_speech_threshold = options.get('no_speech_threshold', 0.6)
+    logprob_threshold = options.get('logprob_threshold', -1.0)
+    if no_speech_threshold is None or decoded.no_speech_prob <= no_speech_threshold:
+        return False
+    return logprob_threshold is None or decoded.avg_logprob < logprob_threshold
+
+
+def needs_escalation(decoded, options, policy):
+    """Janela decodificada de forma gulosa que deve ser refeita com a busca em feixe."""
+    if is_silent(decoded, options):
+        return False  # Silêncio: a busca em feixe não muda nada
+    if decoded.compression_ratio > policy['compression_ratio_threshold']:
+        return True  # Provavelmente repetitivo
+    if decoded.avg_logprob < policy['logprob_threshold']:
+        return True  # Pouca confiança
+    # Texto com probabilidade relevante de silêncio: o modelo está em dúvida
+    return decoded.no_speech_prob > policy['no_speech_threshold'] and bool(decoded.text.strip())
+
+
+def decode_adaptive(model, audio_features, options, prompt, policy=None):
+    """Decodifica primeiro de forma gulosa e sobe para as opções pedidas só se a janela for duvidosa.
+
+    Retorna (resultado, nível). Sem política, ou com opções já gulosas, decodifica direto.
+    """
+    tier = options_tier(options)
+    if policy is None or tier == 'greedy':
+        return decode_with_fallback(model, audio_features, options, prompt), tier
+
+    greedy = decode_with_fallback(model, audio_features, dict(options, beam_size=1, best_of=1, temperature=0.0),
+                                  prompt)
+    if not needs_escalation(greedy, options, policy):
+        return greedy, 'greedy'
+    return decode_with_fallback(model, audio_features, options, prompt), tier
+
+
+def window_failed(decoded, options):
+    """Janela que precisa ser redecodificada: texto repetitivo (alucinação) mesmo
+    após o fallback de temperatura, ou vazio quando o modelo indica que há fala."""
+    compression_threshold = options.get('compression_ratio_threshold', 2.4)
+    no_speech_threshold = options.get('no_speech_threshold', 0.6)
+    if compression_threshold is not None and decoded.compression_ratio > compression_threshold:
+        return True
+    has_speech = no_speech_threshold is None or decoded.no_speech_prob <= no_speech_threshold
+    return has_speech and not decoded.text.strip()
+
+
+def decode_window(model, audio_features, options, prompt, fallbacks=(), policy=None):
+    """Decodifica uma janela; se falhar, tenta de novo só ela com cada opção de `fallbacks`.
+
+    Retorna (resultado, tentativas, nível). O resultado é None se todas as
+    tentativas lançaram exceção; se todas alucinaram, fica a menos repetitiva.
+    A política adaptativa vale apenas para a primeira tentativa.
+    """
+    attempts = [(options, prompt, policy)] + [(fallback, None, None) for fallback in fallbacks]
+    best = None
+    best_tier = None
+    for attempt, (attempt_options, attempt_prompt, attempt_policy) in enumerate(attempts, 1):
+        try:
+            decoded, tier = decode_adaptive(model, audio_features, attempt_options, attempt_prompt, attempt_policy)
+        except Exception as e:
+            logger.warning(f"Erro ao decodificar janela (tentativa {attempt}): {str(e)}")
+            continue
+        if not window_failed(decoded, options):
+            return decoded, attempt, tier
+        if best is None or decoded.compression_ratio < best.compression_ratio:
+            best, best_tier = decoded, tier
+    return best, len(attempts), best_tier
+
+
+def segments_from_tokens(tokenizer, tokens, offset, duration):
+    """Converte os tokens de uma janela em trechos com timestamps absolutos (em segundos)."""
+    segments = []
+    start = None
+    text_tokens = []
+    for token in tokens:
+        if token >= tokenizer.timestamp_begin:
+            timestamp = min((token - tokenizer.timestamp_begin) * TIME_PRECISION, duration)
+            if text_tokens:
+                segments.append((0.0 if start is None else start, timestamp, text_tokens))
+                text_tokens = []
+                start = None
+            else:
+                start = timestamp
+        else:
+            text_tokens.append(token)
+    if text_tokens:
+        # Trecho sem timestamp final vai até o fim da janela
+        segments.append((0.0 if start is None else start, duration, text_tokens))
+
+    return [
+        {
+            'start': round(offset + start, 3),
+            'end': round(offset + max(start, end), 3),
+            'text': tokenizer.decode([t for t in text_tokens if t < tokenizer.eot]),
+            'tokens': text_tokens
+        }
+        for start, end, text_tokens in segments
+    ]
+
+
+def transcribe_batched(model, audios, options, batch_size=8, sample_rate=SAMPLE_RATE, encoder_cache=None,
+                       window_fallbacks=(), policy=None):
+    """Transcreve um ou mais áudios com o encoder rodando em lote sobre todas as janelas.
+
+    `audios` é uma lista de arrays float32 a 16 kHz; retorna uma lista de
+    resultados no formato do `transcribe()` do Whisper, na mesma ordem, com
+    'window_attempts' (tentativas por janela) e 'window_tiers' (nível usado em
+    cada janela). `encoder_cache` (EncoderCache) reaproveita as features entre
+    tentativas; `window_fallbacks` são as opções usadas, em ordem, para
+    redecodificar apenas as janelas que falharem; `policy` (limiares
+    'logprob_threshold', 'compression_ratio_threshold' e 'no_speech_threshold')
+    ativa a decodificação gulosa primeiro.
+    """
+    tokenizer = get_tokenizer(
+        model.is_multilingual,
+        num_languages=model.num_languages,
+        language=options.get('language'),
+        task=options.get('task', 'transcribe')
+    )
+
+    # Janelas de todos os áudios entram no mesmo lote do encoder
+    bounds = [split_windows(audio, sample_rate) for audio in audios]
+    windows = [audio[start:end] for audio, audio_bounds in zip(audios, bounds) for start, end in audio_bounds]
+    if not windows:
+        return [{'text': '', 'segments': [], 'language': options.get('language')} for _ in audios]
+    hits_before = encoder_cache.hits if encoder_cache is not None else 0
+    audio_features = encode_windows(model, windows, batch_size, options.get('fp16', False), encoder_cache)
+    reused = encoder_cache.hits - hits_before if encoder_cache is not None else 0
+    logger.info(f"Encoder em lote: {len(windows)} janelas de {len(audios)} áudio(s), lotes de {batch_size}, "
+                f"{reused} reaproveitadas do cache")
+
+    initial_prompt = options.get('initial_prompt') or ''
+    condition_on_previous_text = options.get('condition_on_previous_text', True)
+    max_prompt = model.dims.n_text_ctx // 2 - 1
+
+    results = []
+    feature_index = 0
+    for audio_bounds in bounds:
+        prompt_tokens = tokenizer.encode(' ' + initial_prompt.strip()) if initial_prompt.strip() else []
+        segments = []
+        window_attempts = []
+        window_tiers = []
+        for start, end in audio_bounds:
+            decoded, attempts, tier = decode_window(model, audio_features[feature_index], options, prompt_tokens,
+                                                    window_fallbacks, policy)
+            feature_index += 1
+            window_attempts.append(attempts)
+            window_tiers.append(tier)
+            if attempts > 1:
+                logger.info(f"Janela {start / sample_rate:.1f}-{end / sample_rate:.1f}s redecodificada "
+                            f"({attempts} tentativas{'' if decoded is not None else ', sem sucesso'})")
+            if decoded is None:
+                prompt_tokens = []
+                continue
+
+            if is_silent(decoded, options):
+                continue
+
+            window_segments = segments_from_tokens(
+                tokenizer, decoded.tokens, start / sample_rate, (end - start) / sample_rate
+            )
+            for segment in window_segments:
+                segment.update({
+                    'temperature': decoded.temperature,
+                    'avg_logprob': decoded.avg_logprob,
+                    'compression_ratio': decoded.compression_ratio,
+                    'no_speech_prob': decoded.no_speech_prob,
+                    'window_attempts': attempts,
+                    'decode_tier': tier
+                })
+            segments.extend(s for s in window_segments if s['text'].strip())
+
+            if condition_on_previous_text and decoded.temperature <= 0.5:
+                # O decodificador usa no máximo metade do contexto de texto como prompt
+                prompt_tokens = (prompt_tokens + [t for t in decoded.tokens if t < tokenizer.eot])[-max_prompt:]
+            else:
+                prompt_tokens = []
+
+        if policy is not None:
+            logger.info(f"Decodificação adaptativa: {window_tiers.count('greedy')} janelas gulosas, "
+                        f"{window_tiers.count('beam')} com busca em feixe")
+        for index, segment in enumerate(segments):
+            segment['id'] = index
+        results.append({
+            'text': ''.join(segment['text'] for segment in segments),
+            'segments': segments,
+            'language': options.get('language'),
+            'window_attempts': window_attempts,
+            'window_tiers': window_tiers
+        })
+    return results
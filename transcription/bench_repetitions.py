@@ -0,0 +1,138 @@
+"""Compara a remoção de repetições anterior (strings) com a de tempo linear (repetitions.py).
+
+Uso:
+    python bench_repetitions.py [sessao.json | diretório ...] [--repeat N]
+
+As amostras são os textos originais dos segmentos e frases que o Whisper
+produziu com repetição (campo 'corrected') nos JSONs de sessão informados
+(por padrão, DATA_FOLDER). Amostras sintéticas de loops de alucinação
+completam o conjunto. Para cada amostra as duas saídas precisam ser idênticas.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+from repetitions import collapse_repetitions
+
+
+def collapse_repetitions_legacy(words):
+    """Implementação anterior de fix_repetitions(), mantida como referência."""
+    cleaned_words = []
+    i = 0
+    repetition_detected = False
+
+    while i < len(words):
+        repetition_found = False
+
+        for phrase_length in range(2, min(11, len(words) - i)):
+            phrase = ' '.join(words[i:i+phrase_length])
+
+            j = i + phrase_length
+            while j + phrase_length <= len(words):
+                next_phrase = ' '.join(words[j:j+phrase_length])
+
+                if phrase.lower() == next_phrase.lower():
+                    j += phrase_length
+                else:
+                    break
+
+            if j > i + phrase_length:
+                i = j
+                repetition_found = True
+                repetition_detected = True
+                break
+
+        if not repetition_found:
+            cleaned_words.append(words[i])
+            i += 1
+
+    return cleaned_words, repetition_detected
+
+
+def synthetic_samples():
+    """Loops típicos de alucinação do Whisper em áudio ruidoso ou silencioso."""
+    speech = ("O presidente declarou aberta a sessão e solicitou ao primeiro secretário "
+              "a leitura da ata da reunião anterior, que foi aprovada por unanimidade.")
+    return {
+        'palavra única (2000x)': ' '.join(['Obrigado.'] * 2000),
+        'frase de 3 palavras (1000x)': ' '.join(['Muito obrigado, presidente.'] * 1000),
+        'frase de 7 palavras (300x)': ' '.join(['Vamos passar para a ordem do dia.'] * 300),
+        'caixa alternada (500x)': ' '.join(['Sim, senhor.', 'SIM, SENHOR.'] * 500),
+        'fala com loop no meio': ' '.join([speech] * 3 + ['Legenda Adriana Zanotto.'] * 400 + [speech] * 3),
+        'fala sem repetição': ' '.join(f"{speech} Item {n}." for n in range(200)),
+    }
+
+
+def recorded_samples(paths):
+    """Textos originais com repetição corrigida nos JSONs de sessão."""
+    files = []
+    for path in paths:
+        files.extend(sorted(glob.glob(os.path.join(path, '*.json'))) if os.path.isdir(path) else [path])
+
+    samples = {}
+    for file_path in files:
+        try:
+            with open(file_path, 'r') as f:
+                session_data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if not isinstance(session_data, dict):
+            continue
+        session_id = session_data.get('session_id', os.path.basename(file_path))
+        for segment in session_data.get('transcript') or []:
+            entries = [('texto', segment)] + [(f"frase {n}", phrase) for n, phrase in enumerate(segment.get('phrases') or [])]
+            for label, entry in entries:
+                text = entry.get('original_text') or ''
+                if entry.get('corrected') and len(text.split()) >= 5:
+                    samples[f"{session_id} seg {segment.get('segment_index')} {label}"] = text
+    return samples
+
+
+def best_time(function, words, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(words)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', default=[os.environ.get('DATA_FOLDER', '/app/data')])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    samples = recorded_samples(args.paths)
+    print(f"{len(samples)} amostras gravadas em {', '.join(args.paths)}")
+    samples.update(synthetic_samples())
+
+    print(f"{'amostra':<50} {'palavras':>8} {'anterior (ms)':>14} {'linear (ms)':>12} {'ganho':>7}")
+    total_legacy = total_linear = 0.0
+    mismatches = 0
+    for name, text in samples.items():
+        words = text.split()
+        if collapse_repetitions_legacy(words) != collapse_repetitions(words):
+            mismatches += 1
+            print(f"SAÍDA DIFERENTE: {name}")
+            continue
+        legacy = best_time(collapse_repetitions_legacy, words, args.repeat)
+        linear = best_time(collapse_repetitions, words, args.repeat)
+        total_legacy += legacy
+        total_linear += linear
+        print(f"{name[:50]:<50} {len(words):>8} {legacy * 1000:>14.2f} {linear * 1000:>12.2f} "
+              f"{legacy / linear if linear else float('inf'):>6.1f}x")
+
+    print(f"{'total':<50} {'':>8} {total_legacy * 1000:>14.2f} {total_linear * 1000:>12.2f} "
+          f"{total_legacy / total_linear if total_linear else float('inf'):>6.1f}x")
+    if mismatches:
+        print(f"{mismatches} amostra(s) com saída diferente")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,243 @@
+"""Motores de inferência usados pela transcrição.
+
+Todo motor expõe a mesma interface:
+
+- load(): carrega os pesos (chamado uma vez, pelo cache de modelos);
+- transcribe(audio, options): recebe um array float32 a 16 kHz (ou o caminho
+  do arquivo) e as opções no formato do `transcribe()` do Whisper, e retorna
+  {'text', 'segments', 'language'} com os trechos em segundos;
+- warmup(): roda uma inferência curta para que a primeira requisição real não
+  pague a inicialização preguiçosa de kernels e tokenizer;
+- memory_bytes(): memória ocupada, usada no orçamento do cache (0 se desconhecida).
+
+O motor é escolhido por WHISPER_ENGINE: 'whisper' (OpenAI Whisper, padrão),
+'ctranslate2' (faster-whisper, int8 em CPU) ou 'stub' (determinístico, sem modelo: roda o pipeline sem carregar pesos).
+"""
+import logging
+import os
+from abc import ABC, abstractmethod
+
+import numpy as np
+import torch
+import whisper
+
+from audio_inspect import inspect_wav
+from batched_decode import transcribe_batched
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+
+
+class Engine(ABC):
+    name = None
+
+    def __init__(self, model_size, device, **config):
+        self.model_size = model_size
+        self.device = device
+        self.config = config
+
+    @abstractmethod
+    def load(self):
+        pass
+
+    @abstractmethod
+    def transcribe(self, audio, options, encoder_cache=None, window_fallbacks=()):
+        """`encoder_cache` e `window_fallbacks` são opcionais; motores que não os suportam os ignoram."""
+
+    def warmup(self):
+        # Um segundo de silêncio percorre todo o caminho de inferência
+        self.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32), {
+            'language': 'pt',
+            'task': 'transcribe',
+            'temperature': 0.0,
+            'beam_size': 1,
+            'best_of': 1,
+            'fp16': False,
+            'condition_on_previous_text': False
+        })
+
+    def memory_bytes(self):
+        return 0
+
+
+def _prepare_for_quantization(model):
+    """Troca as camadas Linear do Whisper (subclasse que converte o dtype dos pesos)
+    por nn.Linear, o único tipo aceito por quantize_dynamic."""
+    for module in model.modules():
+        if type(module) is whisper.model.Linear:
+            module.__class__ = torch.nn.Linear
+    return model
+
+
+def _tensor_bytes(value):
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, (tuple, list)):
+        # Camadas quantizadas guardam (peso int8, bias) empacotados
+        return sum(_tensor_bytes(item) for item in value)
+    return 0
+
+
+class WhisperEngine(Engine):
+    """OpenAI Whisper em PyTorch, com o modo de encoder em lote e a quantização int8 opcionais."""
+    name = 'whisper'
+
+    def load(self):
+        if self.config.get('quantize') == 'int8':
+            if self.device == 'cpu':
+                self.model = self._load_quantized()
+            else:
+                logger.warning("Quantização dinâmica int8 só é suportada em CPU; usando o modelo em ponto flutuante")
+                self.model = whisper.load_model(self.model_size, device=self.device)
+        else:
+            self.model = whisper.load_model(self.model_size, device=self.device)
+        logger.info(f"Modelo {self.model_size} carregado com sucesso")
+
+        # Configurações específicas para evitar problemas de tensor
+        if hasattr(self.model, 'encoder'):
+            self.model.encoder.conv1.register_forward_hook(lambda module, input, output: None)
+            logger.info("Hook de forward registrado para evitar problemas de tensor")
+
+    def _load_quantized(self):
+        """Modelo com as camadas Linear quantizadas (int8 dinâmico).
+
+        O módulo já quantizado fica em cache (inteiro, não só o state dict) no
+        volume de modelos; nas inicializações seguintes ele é lido diretamente,
+        sem materializar os pesos float nem refazer a conversão.
+        """
+        cache_path = os.path.join(
+            self.config.get('quantized_dir') or os.path.expanduser('~/.cache/whisper'),
+            f"{self.model_size}-int8-dynamic-module-torch{torch.__version__}.pt"
+        )
+        if os.path.exists(cache_path):
+            model = torch.load(cache_path, map_location='cpu', weights_only=False).eval()
+            logger.info(f"Modelo {self.model_size} int8 carregado do cache {cache_path}")
+        else:
+            model = _prepare_for_quantization(whisper.load_model(self.model_size, device='cpu').eval())
+            with torch.inference_mode():
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            # Gravação atômica: vários workers podem converter ao mesmo tempo na primeira vez
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            temp_path = f"{cache_path}.{os.getpid()}.tmp"
+            torch.save(model, temp_path)
+            os.replace(temp_path, cache_path)
+            logger.info(f"Modelo {self.model_size} quantizado para int8 e salvo em {cache_path}")
+        return model
+
+    def transcribe(self, audio, options, encoder_cache=None, window_fallbacks=()):
+        with torch.inference_mode():
+            if self.config.get('batched') and isinstance(audio, np.ndarray):
+                return transcribe_batched(self.model, [audio], options, batch_size=self.config.get('batch_size', 8),
+                                          encoder_cache=encoder_cache, window_fallbacks=window_fallbacks,
+                                          policy=self.config.get('adaptive_policy'))[0]
+            return self.model.transcribe(audio, **options)
+
+    def memory_bytes(self):
+        return sum(_tensor_bytes(value) for value in self.model.state_dict().values())
+
+
+class CTranslate2Engine(Engine):
+    """faster-whisper (CTranslate2) com os mesmos pesos, quantizado em int8 por padrão."""
+    name = 'ctranslate2'
+
+    def load(self):
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError as e:
+            raise RuntimeError("WHISPER_ENGINE=ctranslate2 requer o pacote faster-whisper") from e
+
+        self.model = WhisperModel(
+            self.model_size,
+            device=self.device,
+            compute_type=self.config.get('compute_type', 'int8'),
+            cpu_threads=torch.get_num_threads(),
+            download_root=self.config.get('download_root')
+        )
+        logger.info(f"Modelo {self.model_size} carregado com CTranslate2 ({self.config.get('compute_type', 'int8')})")
+
+    def transcribe(self, audio, options, encoder_cache=None, window_fallbacks=()):
+        temperature = options.get('temperature', 0.0)
+        segments, info = self.model.transcribe(
+            audio,
+            language=options.get('language'),
+            task=options.get('task', 'transcribe'),
+            beam_size=options.get('beam_size') or 1,
+            best_of=options.get('best_of') or 1,
+            temperature=list(temperature) if isinstance(temperature, (list, tuple)) else temperature,
+            compression_ratio_threshold=options.get('compression_ratio_threshold', 2.4),
+            log_prob_threshold=options.get('logprob_threshold', -1.0),
+            no_speech_threshold=options.get('no_speech_threshold', 0.6),
+            condition_on_previous_text=options.get('condition_on_previous_text', True),
+            initial_prompt=options.get('initial_prompt') or None,
+            suppress_blank=options.get('suppress_blank', True),
+            word_timestamps=options.get('word_timestamps', False)
+        )
+        # O gerador só decodifica ao ser consumido
+        result_segments = [
+            {
+                'id': segment.id,
+                'start': segment.start,
+                'end': segment.end,
+                'text': segment.text,
+                'tokens': list(segment.tokens),
+                'temperature': segment.temperature,
+                'avg_logprob': segment.avg_logprob,
+                'compression_ratio': segment.compression_ratio,
+                'no_speech_prob': segment.no_speech_prob
+            }
+            for segment in segments
+        ]
+        return {
+            'text': ''.join(segment['text'] for segment in result_segments),
+            'segments': result_segments,
+            'language': info.language
+        }
+
+
+class StubEngine(Engine):
+    """Motor determinístico sem modelo: um trecho fixo a cada `stub_phrase_seconds`."""
+    name = 'stub'
+
+    def load(self):
+        pass
+
+    def warmup(self):
+        pass
+
+    def transcribe(self, audio, options, encoder_cache=None, window_fallbacks=()):
+        if isinstance(audio, np.ndarray):
+            duration = len(audio) / SAMPLE_RATE
+        else:
+            duration = inspect_wav(audio, compute_stats=False)['duration']
+
+        step = self.config.get('stub_phrase_seconds', 10.0)
+        segments = []
+        start = 0.0
+        while start < duration:
+            end = min(start + step, duration)
+            segments.append({
+                'id': len(segments),
+                'start': round(start, 3),
+                'end': round(end, 3),
+                'text': f" Trecho {len(segments) + 1} de teste.",
+                'temperature': 0.0,
+                'avg_logprob': -0.1,
+                'compression_ratio': 1.0,
+                'no_speech_prob': 0.0
+            })
+            start = end
+        return {
+            'text': ''.join(segment['text'] for segment in segments),
+            'segments': segments,
+            'language': options.get('language', 'pt')
+        }
+
+
+ENGINES = {engine.name: engine for engine in (WhisperEngine, CTranslate2Engine, StubEngine)}
+
+
+def create_engine(engine_name, model_size, device, **config):
+    if engine_name not in ENGINES:
+        raise ValueError(f"Motor de inferência desconhecido: {engine_name} (opções: {', '.join(ENGINES)})")
+    return ENGINES[engine_name](model_size, device, **config)
@@ -0,0 +1,297 @@
+"""Fila de segmentos persistida em SQLite, com concessão (lease) e confirmação (ack).
+
+Tem a mesma interface usada da `queue.Queue` (put, get, task_done, qsize,
+empty, join), para que os workers não mudem:
+
+- get() concede o job mais antigo à thread chamadora por `visibility_timeout`
+  segundos; enquanto a thread estiver viva, a concessão é renovada em segundo
+  plano. Se o processo morrer, a concessão expira e o job volta para a fila;
+- task_done() confirma (apaga) o job concedido à thread; release() o devolve
+  à fila; detach() transfere a concessão para quem for confirmar depois
+  (o pós-processamento confirma só depois de gravar o resultado);
+- recover() devolve à fila, de uma vez, os jobs concedidos a execuções
+  anteriores do serviço — chamado na inicialização;
+- um job concedido `max_attempts` vezes sem confirmação é marcado como 'dead',
+  e `on_dead(session_id, segment_index, error)` é chamado para registrar a falha;
+- uma concessão transferida por detach() é renovada por até `detached_timeout`
+  segundos; depois disso deixa de ser renovada e expira como as demais.
+
+put() ignora um job igual (mesma sessão, segmento e nível de qualidade) que
+já esteja pendente ou em andamento.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from queue import Empty, Full
+
+logger = logging.getLogger(__name__)
+
+
+class DurableJobQueue:
+    def __init__(self, path, maxsize=0, visibility_timeout=900.0, max_attempts=5, poll_interval=1.0,
+                 detached_timeout=3600.0, on_dead=None):
+        self.path = path
+        self.maxsize = maxsize
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.detached_timeout = detached_timeout
+        self.on_dead = on_dead
+        # Identifica esta execução do serviço nas concessões
+        self.instance = uuid.uuid4().hex
+        self._local = threading.local()
+        self._held = {}  # id do job -> thread dona (None: transferido por detach)
+        self._detached_at = {}  # id do job -> instante do detach()
+        self._held_lock = threading.Lock()
+        self._new_job = threading.Condition()
+        self._keeper = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    segment_index INTEGER,
+                    quality_tier TEXT,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    lease_owner TEXT,
+                    lease_until REAL,
+                    enqueued_at REAL NOT NULL,
+                    error TEXT
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)')
+
+    def _connect(self):
+        # Uma conexão por operação: as threads dos workers não compartilham conexões
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _count(self, conn, *statuses):
+        placeholders = ','.join('?' * len(statuses))
+        return conn.execute(f"SELECT COUNT(*) FROM jobs WHERE status IN ({placeholders})", statuses).fetchone()[0]
+
+    def put(self, job, block=True, timeout=None):
+        """Enfileira (segment, session_id). Retorna False se um job igual já estiver na fila."""
+        segment, session_id = job
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self._connect() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    if self.maxsize <= 0 or self._count(conn, 'pending') < self.maxsize:
+                        duplicate = conn.execute(
+                            "SELECT 1 FROM jobs WHERE session_id = ? AND segment_index = ? AND quality_tier IS ? "
+                            "AND status IN ('pending', 'leased')",
+                            (session_id, segment.get('index'), segment.get('quality_tier'))
+                        ).fetchone()
+                        if duplicate is None:
+                            conn.execute(
+                                "INSERT INTO jobs (session_id, segment_index, quality_tier, payload, enqueued_at) "
+                                "VALUES (?, ?, ?, ?, ?)",
+                                (session_id, segment.get('index'), segment.get('quality_tier'),
+                                 json.dumps({'segment': segment, 'session_id': session_id}), time.time())
+                            )
+                        conn.execute('COMMIT')
+                        break
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+            # Fila cheia
+            if not block or (deadline is not None and time.time() >= deadline):
+                raise Full
+            time.sleep(self.poll_interval)
+
+        with self._new_job:
+            self._new_job.notify()
+        return duplicate is None
+
+    def _claim(self):
+        dead = []
+        try:
+            return self._claim_next(dead)
+        finally:
+            # Fora da transação: o callback grava na sessão e pode demorar
+            for session_id, segment_index, error in dead:
+                self._report_dead(session_id, segment_index, error)
+
+    def _report_dead(self, session_id, segment_index, error):
+        if self.on_dead is None:
+            return
+        try:
+            self.on_dead(session_id, segment_index, error)
+        except Exception as e:
+            logger.error(f"Erro ao registrar o job descartado da sessão {session_id}: {str(e)}")
+
+    def _claim_next(self, dead):
+        now = time.time()
+        with self._connect() as conn:
+            # Consulta sem trava antes: workers ociosos não disputam a escrita a cada espera
+            if conn.execute("SELECT 1 FROM jobs WHERE status = 'pending' OR (status = 'leased' AND lease_until < ?) "
+                            "LIMIT 1", (now,)).fetchone() is None:
+                return None
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                while True:
+                    # Pendentes ou com a concessão expirada, na ordem de chegada
+                    row = conn.execute(
+                        "SELECT id, session_id, segment_index, payload, attempts FROM jobs "
+                        "WHERE status = 'pending' OR (status = 'leased' AND lease_until < ?) ORDER BY id LIMIT 1",
+                        (now,)
+                    ).fetchone()
+                    if row is None:
+                        conn.execute('COMMIT')
+                        return None
+                    job_id, session_id, segment_index, payload, attempts = row
+                    if attempts >= self.max_attempts:
+                        error = f"concessão expirou em todas as {attempts} tentativas"
+                        conn.execute("UPDATE jobs SET status = 'dead', lease_owner = NULL, lease_until = NULL, "
+                                     "error = ? WHERE id = ?", (error, job_id))
+                        logger.error(f"Job {job_id} descartado após {attempts} concessões sem confirmação")
+                        dead.append((session_id, segment_index, error))
+                        continue
+                    conn.execute(
+                        "UPDATE jobs SET status = 'leased', attempts = attempts + 1, lease_owner = ?, lease_until = ? "
+                        "WHERE id = ?",
+                        (f"{self.instance}:{threading.current_thread().name}", now + self.visibility_timeout, job_id)
+                    )
+                    conn.execute('COMMIT')
+                    return job_id, json.loads(payload)
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def get(self, block=True, timeout=None):
+        """Concede o próximo job à thread chamadora e retorna (segment, session_id)."""
+        self._start_keeper()
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            claimed = self._claim()
+            if claimed is not None:
+                job_id, payload = claimed
+                self._local.job_id = job_id
+                with self._held_lock:
+                    self._held[job_id] = threading.current_thread()
+                return payload['segment'], payload['session_id']
+            if not block or (deadline is not None and time.time() >= deadline):
+                raise Empty
+            wait = self.poll_interval if deadline is None else min(self.poll_interval, deadline - time.time())
+            with self._new_job:
+                self._new_job.wait(max(wait, 0))
+
+    def _current(self):
+        job_id = getattr(self._local, 'job_id', None)
+        self._local.job_id = None
+        return job_id
+
+    def task_done(self):
+        """Confirma o job concedido à thread chamadora (nada a fazer se ele foi transferido ou devolvido)."""
+        job_id = self._current()
+        if job_id is not None:
+            self.ack(job_id)
+
+    def detach(self):
+        """Retira da thread o job concedido e retorna o id para um ack()/release() posterior."""
+        job_id = self._current()
+        if job_id is not None:
+            with self._held_lock:
+                self._held[job_id] = None
+                self._detached_at[job_id] = time.time()
+        return job_id
+
+    def ack(self, job_id):
+        with self._held_lock:
+            self._held.pop(job_id, None)
+            self._detached_at.pop(job_id, None)
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def release(self, job_id=None):
+        """Devolve o job à fila imediatamente (por padrão, o concedido à thread chamadora)."""
+        if job_id is None:
+            job_id = self._current()
+        if job_id is None:
+            return
+        with self._held_lock:
+            self._held.pop(job_id, None)
+            self._detached_at.pop(job_id, None)
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'pending', lease_owner = NULL, lease_until = NULL WHERE id = ?",
+                         (job_id,))
+        with self._new_job:
+            self._new_job.notify()
+
+    def recover(self):
+        """Devolve à fila os jobs concedidos a execuções anteriores; retorna (devolvidos, pendentes)."""
+        with self._connect() as conn:
+            returned = conn.execute(
+                "UPDATE jobs SET status = 'pending', lease_owner = NULL, lease_until = NULL "
+                "WHERE status = 'leased' AND lease_owner NOT LIKE ?",
+                (f"{self.instance}:%",)
+            ).rowcount
+            return returned, self._count(conn, 'pending')
+
+    def _start_keeper(self):
+        with self._held_lock:
+            if self._keeper is None or not self._keeper.is_alive():
+                self._keeper = threading.Thread(target=self._renew_leases, name='job-queue-keeper', daemon=True)
+                self._keeper.start()
+
+    def _renew_leases(self):
+        """Renova as concessões cujas threads donas continuam vivas (ou transferidas há menos de `detached_timeout`)."""
+        while True:
+            time.sleep(max(self.visibility_timeout / 3, 1))
+            now = time.time()
+            with self._held_lock:
+                # Transferidas há tempo demais (por exemplo, o pós-processamento parou): deixar expirar
+                for job_id in [job_id for job_id, detached_at in self._detached_at.items()
+                               if now - detached_at > self.detached_timeout]:
+                    logger.warning(f"Job {job_id} transferido há mais de {self.detached_timeout:.0f} s sem confirmação; "
+                                   f"a concessão vai expirar e o job volta para a fila")
+                    self._held.pop(job_id, None)
+                    self._detached_at.pop(job_id, None)
+                job_ids = [job_id for job_id, owner in self._held.items() if owner is None or owner.is_alive()]
+            if not job_ids:
+                continue
+            try:
+                with self._connect() as conn:
+                    conn.execute(
+                        f"UPDATE jobs SET lease_until = ? WHERE status = 'leased' "
+                        f"AND id IN ({','.join('?' * len(job_ids))})",
+                        [time.time() + self.visibility_timeout] + job_ids
+                    )
+            except sqlite3.Error as e:
+                logger.error(f"Erro ao renovar concessões da fila: {str(e)}")
+
+    def qsize(self):
+        with self._connect() as conn:
+            return self._count(conn, 'pending')
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def dead_segments(self, session_id):
+        """Índices dos segmentos da sessão descartados após `max_attempts` concessões."""
+        with self._connect() as conn:
+            return {row[0] for row in conn.execute(
+                "SELECT DISTINCT segment_index FROM jobs WHERE session_id = ? AND status = 'dead'", (session_id,))}
+
+    def counts(self):
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def join(self):
+        """Espera até não haver jobs pendentes nem em andamento."""
+        while True:
+            with self._connect() as conn:
+                if self._count(conn, 'pending', 'leased') == 0:
+                    return
+            time.sleep(self.poll_interval)
@@ -0,0 +1,54 @@
+"""Remoção de repetições (loops de alucinação) sem montar strings.
+
+As palavras são convertidas para minúsculas uma única vez, e cada frase é
+comparada como fatia da lista (no máximo 10 palavras), sem `' '.join(...)`.
+Uma frase de tamanho L só pode se repetir na posição i se a palavra de i
+reaparece em i + L; esse teste é feito em C (`in` sobre as 10 palavras
+seguintes) antes de qualquer comparação de frase, então o texto sem
+repetição custa uma busca curta por palavra. O resultado é exatamente o
+da versão anterior de `fix_repetitions()`, que comparava `' '.join(...).lower()`.
+"""
+
+# Tamanhos de frase verificados, como na versão anterior (2 a 10 palavras)
+MIN_PHRASE_WORDS = 2
+MAX_PHRASE_WORDS = 10
+
+
+def collapse_repetitions(words):
+    """Remove as frases repetidas em sequência; retorna (palavras restantes, houve_repetição).
+
+    Em cada posição, a menor frase (de 2 a 10 palavras) que se repete logo em
+    seguida é descartada junto com todas as suas repetições consecutivas.
+    """
+    n = len(words)
+    lowered = [word.lower() for word in words]
+
+    cleaned_words = []
+    repetition_detected = False
+    i = 0
+    while i < n:
+        first = lowered[i]
+        # Tamanhos candidatos em ordem crescente, como no laço original de 2 a 10
+        end = min(i + MAX_PHRASE_WORDS + 1, n)
+        if first in lowered[i + MIN_PHRASE_WORDS:end]:
+            for k in range(i + MIN_PHRASE_WORDS, end):
+                if lowered[k] != first:
+                    continue
+                phrase_length = k - i
+                phrase = lowered[i:k]
+                j = k
+                while j + phrase_length <= n and lowered[j:j + phrase_length] == phrase:
+                    j += phrase_length
+                if j > k:
+                    # Pular a frase e todas as repetições
+                    i = j
+                    repetition_detected = True
+                    break
+            else:
+                cleaned_words.append(words[i])
+                i += 1
+            continue
+        cleaned_words.append(words[i])
+        i += 1
+
+    return cleaned_words, repetition_detected